@@ -1,3 +1,4 @@
-from uaclient.mainwindow import main
+import sys
+from uaclient.cli import main
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
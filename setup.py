@@ -10,6 +10,6 @@ setup(name="opcua-client",
       license="GNU General Public License",
       install_requires=["asyncua", "opcua-widgets>=0.6.0", "PyQt5"],
       entry_points={'console_scripts':
-                    ['opcua-client = uaclient.mainwindow:main']
+                    ['opcua-client = uaclient.cli:main']
                     }
       )
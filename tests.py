@@ -1,20 +1,43 @@
 
 import unittest
+import asyncio
 import sys
 print("SYS:PATH", sys.path)
 sys.path.insert(0, "python-opcua")
 sys.path.insert(0, "opcua-widgets")
 import os
+import tempfile
+import subprocess
+import io
+import argparse
+import json
+import time
+from datetime import datetime, timezone
 print("PWD", os.getcwd())
 
 from opcua import ua
 from opcua import Server
+from asyncua import ua as async_ua
+from asyncua.common.structures104 import make_structure
 
 from PyQt5.QtCore import QTimer, QSettings, QModelIndex, Qt, QCoreApplication
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtTest import QTest
 
 from uaclient.mainwindow import Window
+from uaclient.type_cache import TypeCache, TypeDefinitions, types_changed
+from uaclient.browse_cache import BrowseCache
+from uaclient.uaclient import UaClient, MemorySettings, SubscriptionParameters, EventFilterParameters, _content_filter
+from uaclient.datachange_model import DataChangeModel
+from uaclient.event_model import EventModel
+from uaclient.ring_buffer import RingBuffer
+from uaclient.decimation import MinMaxCache, minmax_decimate, visible_slice
+from uaclient.recorder import Recorder, Recording
+from uaclient.replay import Player
+from uaclient.cli import RowWriter, read_command, VALUE_COLUMNS
+from uaclient.timing import PhaseTimer
+
+import numpy as np
 
 
 class TestClient(unittest.TestCase):
@@ -26,6 +49,11 @@ class TestClient(unittest.TestCase):
         self.client = Window()
         self.client.ui.addrComboBox.setCurrentText(url)
         self.client.connect()
+        # connection is done in background, wait for root node to show up
+        for _ in range(500):
+            if self.client.tree_ui.model.rowCount():
+                break
+            QTest.qWait(10)
 
     def tearDown(self):
         self.client.disconnect()
@@ -59,6 +87,587 @@ class TestClient(unittest.TestCase):
         self.assertEqual(data, server_node.nodeid)
 
 
+class TestTypeCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TypeCache(tempfile.mkdtemp())
+
+    def test_roundtrip(self):
+        definitions = TypeDefinitions()
+        definitions.aliases.append(("MyTestString", async_ua.NodeId(3, 2), "String"))
+        edef = async_ua.EnumDefinition(Fields=[async_ua.EnumField(Value=1, DisplayName=async_ua.LocalizedText("One"), Name="One")])
+        definitions.enums.append(("MyTestEnum", async_ua.NodeId(1, 2), edef, False))
+        sdef = async_ua.StructureDefinition(DefaultEncodingId=async_ua.NodeId(5, 2), BaseDataType=async_ua.NodeId(22),
+                                            Fields=[async_ua.StructureField(Name="x", DataType=async_ua.NodeId(11), ValueRank=-1)])
+        definitions.structs.append(("MyTestStruct", async_ua.NodeId("s", 2), sdef))
+        self.cache.save("opc.tcp://host:4840", "fingerprint", definitions)
+        cached = self.cache.load("opc.tcp://host:4840", "fingerprint")
+        self.assertEqual(cached.aliases, definitions.aliases)
+        self.assertEqual(cached.enums, definitions.enums)
+        self.assertEqual(cached.structs, definitions.structs)
+
+    def test_corrupt(self):
+        self.cache.save("opc.tcp://host:4840", "fingerprint", TypeDefinitions())
+        with open(self.cache._file_name("opc.tcp://host:4840"), "w") as f:
+            f.write("{")
+        with self.assertLogs("uaclient.type_cache", "ERROR"):
+            self.assertIsNone(self.cache.load("opc.tcp://host:4840", "fingerprint"))
+
+    def test_stale(self):
+        self.cache.save("opc.tcp://host:4840", "fingerprint", TypeDefinitions())
+        self.assertIsNone(self.cache.load("opc.tcp://host:4840", "other fingerprint"))
+        self.assertIsNone(self.cache.load("opc.tcp://other:4840", "fingerprint"))
+        self.cache.invalidate("opc.tcp://host:4840")
+        self.assertIsNone(self.cache.load("opc.tcp://host:4840", "fingerprint"))
+
+    def test_types_changed(self):
+        event = FakeEvent(100)
+        self.assertTrue(types_changed(event))
+        variable = async_ua.ModelChangeStructureDataType(async_ua.NodeId(1, 2), async_ua.NodeId(63), 1)
+        event.Changes = [variable]
+        self.assertFalse(types_changed(event))
+        event.Changes = [variable, async_ua.ModelChangeStructureDataType(async_ua.NodeId(2, 2), async_ua.NodeId(), 1)]
+        self.assertTrue(types_changed(event))
+
+class TestBrowseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = BrowseCache(max_size=2)
+        cache.put(("a", 33), [])
+        cache.put(("b", 33), [])
+        cache.get(("a", 33))
+        cache.put(("c", 33), [])
+        self.assertIsNone(cache.get(("b", 33)))
+        self.assertEqual(cache.get(("a", 33)), [])
+
+    def test_invalidate(self):
+        cache = BrowseCache()
+        cache.put(("a", 33), [])
+        cache.put(("a", 35), [])
+        cache.put(("b", 33), [])
+        cache.invalidate("a")
+        self.assertEqual(len(cache), 1)
+
+
+class TestBrowse(unittest.TestCase):
+    def setUp(self):
+        self.uaclient = UaClient(MemorySettings())
+        self.uaclient.client = FakeClient()
+        self.uaclient._operation_limits["MaxNodesPerBrowse"] = 0
+        self.server = self.uaclient.client.aio_obj.uaclient
+
+    def test_release_continuation_points(self):
+        nodes = [async_ua.NodeId(i, 2) for i in range(3)]
+        found = asyncio.run(self.uaclient.collect_variables_async(nodes, max_count=1))
+        self.assertEqual(len(found), 1)
+        # node i=0 is complete after first page, the others are still pending
+        self.assertEqual(self.server.released, [b"1", b"2"])
+
+    def test_failed_node(self):
+        self.server.fail = async_ua.NodeId(1, 2)
+        nodes = [async_ua.NodeId(i, 2) for i in range(3)]
+        results = asyncio.run(self.uaclient.browse_many_async(nodes))
+        self.assertEqual([len(results[nodeid]) for nodeid in nodes], [1, 0, 2])
+        self.assertEqual(self.server.released, [])
+        with self.assertRaises(async_ua.UaStatusCodeError):
+            asyncio.run(self.uaclient.get_children_async(FakeNode(nodes[1])))
+
+
+class TestSubscriptions(unittest.TestCase):
+    def setUp(self):
+        self.uaclient = UaClient(MemorySettings())
+        self.uaclient.client = FakeClient()
+        self.uaclient._operation_limits["MaxMonitoredItemsPerCall"] = 0
+        self.aio_client = self.uaclient.client.aio_obj
+
+    def test_delete_empty_subscription(self):
+        handler = FakeHandler()
+        nodes = [FakeNode(async_ua.NodeId(i, 2)) for i in range(2)]
+
+        async def subscribe_unsubscribe():
+            await self.uaclient.subscribe_datachange_many_async(nodes, handler)
+            await self.uaclient.unsubscribe_datachange_async(nodes[0], handler)
+            self.assertEqual(len(self.uaclient._datachange_subs), 1)
+            await self.uaclient.unsubscribe_datachange_async(nodes[1], handler)
+
+        asyncio.run(subscribe_unsubscribe())
+        self.assertEqual(self.uaclient._datachange_subs, {})
+        self.assertEqual(self.uaclient._subs_dc, {})
+        self.assertTrue(self.aio_client.subscriptions[0].deleted)
+
+    def test_all_items_failed(self):
+        self.aio_client.fail = async_ua.NodeId(1, 2)
+        with self.assertRaises(async_ua.UaStatusCodeError):
+            asyncio.run(self.uaclient.subscribe_datachange_async(FakeNode(self.aio_client.fail), FakeHandler()))
+        self.assertEqual(self.uaclient._datachange_subs, {})
+        self.assertTrue(self.aio_client.subscriptions[0].deleted)
+
+
+class TestSubscriptionParameters(unittest.TestCase):
+    def test_settings_roundtrip(self):
+        params = SubscriptionParameters.from_list(["50.0", "10", "false", "Percent", "2.5"])
+        self.assertEqual(params.to_list(), [50.0, 10, False, "Percent", 2.5])
+        self.assertEqual(params.make_filter().DeadbandValue, 2.5)
+
+    def test_no_deadband(self):
+        self.assertIsNone(SubscriptionParameters().make_filter())
+
+
+class TestEventFilterParameters(unittest.TestCase):
+    def test_where_clause(self):
+        params = EventFilterParameters.from_list([["i=2041", "ns=2;i=5"], 100, ["i=2253"], []])
+        cf = _content_filter(params.where_condition())
+        self.assertEqual(len(cf.Elements), 7)  # two And, one Or, two OfType, GreaterThanOrEqual and InList
+        self.assertEqual(cf.Elements[0].FilterOperator, 10)  # And
+        for el in cf.Elements:
+            for op in el.FilterOperands:
+                if hasattr(op, "Index"):
+                    self.assertLess(op.Index, len(cf.Elements))
+        self.assertEqual(params.to_list(), [["i=2041", "ns=2;i=5"], 100, ["i=2253"], []])
+
+    def test_no_where_clause(self):
+        self.assertEqual(_content_filter(EventFilterParameters().where_condition()).Elements, [])
+
+
+class TestDataChangeModel(unittest.TestCase):
+    def test_add_remove_nodes(self):
+        model = DataChangeModel()
+        nodes = [FakeNode(ua.NodeId(i, 2)) for i in range(5)]
+        model.add_nodes(nodes, ["n{}".format(i) for i in range(5)])
+        model.remove_nodes([nodes[1].nodeid, nodes[3].nodeid])
+        self.assertEqual(model.rowCount(), 3)
+        self.assertNotIn(nodes[1].nodeid, model)
+        self.assertEqual(model.index(2, 0).data(), "n4")
+        self.assertIs(model.node(nodes[4].nodeid), nodes[4])
+
+
+class TestEventModel(unittest.TestCase):
+    def test_ring_buffer(self):
+        model = EventModel(capacity=3)
+        model.append_events([FakeEvent(1), FakeEvent(2)])
+        model.append_events([FakeEvent(3), FakeEvent(4)])
+        self.assertEqual(model.rowCount(), 3)
+        self.assertEqual(model.evicted, 1)
+        self.assertEqual([model.record(row)[1] for row in range(3)], [2, 3, 4])
+        model.append_events([FakeEvent(i) for i in range(5, 9)])
+        self.assertEqual(model.index(0, 1).data(), "6")
+        self.assertEqual(model.evicted, 5)
+
+    def test_filter(self):
+        model = EventModel(capacity=4)
+        model.append_events([FakeEvent(i, "a" if i % 2 else "b") for i in range(4)])
+        model.set_filter(source="a")
+        self.assertEqual([model.record(row)[1] for row in range(model.rowCount())], [1, 3])
+        model.append_events([FakeEvent(4, "b"), FakeEvent(5, "a")])
+        self.assertEqual([model.record(row)[1] for row in range(model.rowCount())], [3, 5])
+        self.assertEqual(sorted(model.sources), ["a", "b"])
+        model.set_filter()
+        self.assertEqual(model.rowCount(), 4)
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_append(self):
+        buf = RingBuffer(3)
+        buf.append(1)
+        self.assertEqual(list(buf.view()), [1])
+        for i in range(2, 6):
+            buf.append(i)
+        self.assertEqual(list(buf.view()), [3, 4, 5])
+        self.assertTrue(buf.view().base is not None)  # a view, not a copy
+
+    def test_extend(self):
+        buf = RingBuffer(4, shape=(2,))
+        buf.append([0, 0])
+        buf.extend([[i, i] for i in range(1, 7)])
+        self.assertEqual(buf.view()[:, 0].tolist(), [3, 4, 5, 6])
+        self.assertEqual(buf.total, 7)
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+
+    def test_extendleft(self):
+        buf = RingBuffer(5)
+        buf.extend([4, 5])
+        self.assertEqual(buf.extendleft([0, 1, 2, 3]), 3)
+        self.assertEqual(list(buf.view()), [1, 2, 3, 4, 5])
+        self.assertEqual(buf.extendleft([0]), 0)
+
+    def test_two_dimensional(self):
+        buf = RingBuffer(3, shape=(2,))
+        self.assertEqual(buf.view().shape, (0, 2))
+        buf.append([1, 10])
+        buf.extend([[2, 20], [3, 30]])
+        buf.append([4, 40])
+        self.assertEqual(buf.view().tolist(), [[2, 20], [3, 30], [4, 40]])
+        buf.extend(np.zeros((0, 2)))
+        self.assertEqual(len(buf), 3)
+        buf.extend([[i, 10 * i] for i in range(5, 10)])
+        self.assertEqual(buf.view().tolist(), [[7, 70], [8, 80], [9, 90]])
+        self.assertEqual(buf.total, 9)
+        self.assertTrue(buf.view().base is not None)
+        with self.assertRaises(ValueError):
+            buf.append([1, 2, 3])
+
+
+class TestGraph(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication(sys.argv)
+
+    def setUp(self):
+        self.window = Window()
+        self.graph = self.window.graph_ui
+
+    def test_array_length_change(self):
+        self.graph._add_array_channel(FakeVariable(ua.NodeId(1, 2), "Arr"))
+        self.graph._add_array_value(0, [1, 2, 3], None)
+        self.graph._add_array_value(0, [4, 5, 6], None)
+        self.graph._add_array_value(0, [0, 0], ua.StatusCode(ua.StatusCodes.BadNoCommunication))
+        self.assertEqual(self.graph._array_channels[0].view().tolist(), [[1, 2, 3], [4, 5, 6]])
+        with self.assertLogs("uaclient.graphwidget", "WARNING"):
+            self.graph._add_array_value(0, [7, 8], None)
+        self.assertEqual(self.graph._array_channels[0].view().tolist(), [[7, 8]])
+        self.graph._render_array(0)
+        self.assertEqual(self.graph._array_images[0].image.shape, (1, 2))
+
+
+class TestDecimation(unittest.TestCase):
+    def test_minmax(self):
+        x = np.arange(1000.)
+        y = np.zeros(1000)
+        y[123] = 5
+        y[456] = -5
+        y[789] = np.nan
+        dx, dy = minmax_decimate(x, y, 50)
+        self.assertLessEqual(len(dx), 100)
+        self.assertEqual(dy.max(), 5)
+        self.assertEqual(dy.min(), -5)
+        self.assertTrue(np.all(np.diff(dx) >= 0))
+
+    def test_small_input(self):
+        x = np.arange(10.)
+        dx, dy = minmax_decimate(x, x, 50)
+        self.assertIs(dx, x)
+
+    def test_minmax_cache(self):
+        rng = np.random.default_rng(0)
+        x, y = RingBuffer(1000), RingBuffer(1000)
+        cache = MinMaxCache()
+        for _ in range(50):
+            count = int(rng.integers(1, 100))
+            x.extend(np.arange(x.total, x.total + count, dtype=float))
+            values = rng.normal(size=count)
+            values[rng.random(count) < 0.1] = np.nan
+            y.extend(values)
+            first = y.total - len(y)
+            dx, dy = cache.decimate(x.view(), y.view(), first, 50)
+            # same as decimating all samples again
+            ex, ey = MinMaxCache().decimate(x.view(), y.view(), first, 50)
+            np.testing.assert_array_equal(dx, ex)
+            np.testing.assert_array_equal(dy, ey)
+            self.assertLessEqual(len(dx), 4 * 50 + 4)
+            self.assertTrue(np.all(np.diff(dx) >= 0))
+
+    def test_visible_slice(self):
+        x = np.arange(100.)
+        part = visible_slice(x, 10.5, 20.5)
+        self.assertEqual((part.start, part.stop), (10, 22))
+
+
+class TestRecorder(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as path:
+            recorder = Recorder(path, segment_rows=4)
+            recorder.start()
+            for i in range(10):
+                dv = async_ua.DataValue(async_ua.Variant(float(i) if i % 5 else "text"))
+                dv.SourceTimestamp = datetime.fromtimestamp(1000 + i, timezone.utc)
+                recorder.record_value(async_ua.NodeId(i % 2, 2), dv)
+            recorder.stop()
+            self.assertEqual(recorder.rows, 10)
+            self.assertEqual(recorder.segments, 3)
+            rec = Recording(path)
+            self.assertEqual([nodeid.to_string() for nodeid in rec.nodes], ["ns=2;i=0", "ns=2;i=1"])
+            self.assertEqual((rec.start, rec.end), (1000, 1009))
+            self.assertEqual(len(list(rec.segments(rec.nodes[1], start=1008))), 1)
+            stamps, values = rec.values(rec.nodes[1], end=1005)
+            self.assertEqual(list(stamps), [1001, 1003, 1005])
+            self.assertTrue(np.isnan(values[2]))  # string is not a number
+            self.assertEqual(rec.read_segment(rec.index[1])["objects"], {1: "text"})
+
+    def test_structure(self):
+        sdef = async_ua.StructureDefinition(DefaultEncodingId=async_ua.NodeId(5001, 2), BaseDataType=async_ua.NodeId(22),
+                                            Fields=[async_ua.StructureField(Name="X", DataType=async_ua.NodeId(11), ValueRank=-1)])
+        cls = make_structure(async_ua.NodeId(5000, 2), "RecordedStruct", sdef, log_error=False)["RecordedStruct"]
+        with tempfile.TemporaryDirectory() as path:
+            recorder = Recorder(path)
+            recorder.start()
+            recorder.record_value(async_ua.NodeId(1, 2), async_ua.DataValue(async_ua.Variant(async_ua.LocalizedText("text"))))
+            # class is not registered, so value has no binary encoding
+            recorder.record_value(async_ua.NodeId(2, 2), async_ua.DataValue(), cls(X=1.5))
+            recorder.record_value(async_ua.NodeId(3, 2), async_ua.DataValue(async_ua.Variant(2.5)))
+            recorder.stop()
+            self.assertEqual(recorder.rows, 3)
+            self.assertEqual(sorted(os.listdir(path)), ["index.jsonl", "nodes.json", "segment-000000.npz"])
+            rec = Recording(path)
+            columns = rec.read_segment(rec.index[0])
+            self.assertEqual(columns["objects"][0], async_ua.LocalizedText("text"))
+            self.assertIn("1.5", columns["objects"][1])
+            self.assertEqual(columns["value"][2], 2.5)
+
+    def test_types(self):
+        values = [async_ua.Variant(True), async_ua.Variant(7, async_ua.VariantType.Int32),
+                  async_ua.Variant(2 ** 60 + 1, async_ua.VariantType.UInt64), async_ua.Variant(1.5, async_ua.VariantType.Float)]
+        with tempfile.TemporaryDirectory() as path:
+            recorder = Recorder(path)
+            recorder.start()
+            for i, variant in enumerate(values):
+                dv = async_ua.DataValue(variant)
+                dv.SourceTimestamp = datetime.fromtimestamp(1000 + i, timezone.utc)
+                recorder.record_value(async_ua.NodeId(i, 2), dv)
+            recorder.stop()
+            handler = FakeHandler()
+            player = Player(Recording(path), [handler], [], speed=0)
+            player.start()
+            for _ in range(100):
+                if player.finished and player.sent == len(values):
+                    break
+                time.sleep(0.01)
+            player.stop()
+        self.assertEqual([val for _, val in handler.values], [True, 7, 2 ** 60 + 1, 1.5])
+        self.assertEqual([type(val) for _, val in handler.values], [bool, int, int, float])
+        self.assertEqual([data.monitored_item.Value.Value.VariantType for data in handler.data],
+                         [variant.VariantType for variant in values])
+
+    def test_writer_behind(self):
+        with tempfile.TemporaryDirectory() as path:
+            # writer thread is not started, so queue is never emptied
+            recorder = Recorder(path, segment_rows=2, max_pending=1)
+            for i in range(6):
+                recorder.record_value(async_ua.NodeId(1, 2), async_ua.DataValue(async_ua.Variant(float(i))))
+            self.assertEqual(recorder.dropped, 4)
+
+
+class TestPlayer(unittest.TestCase):
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as path:
+            recorder = Recorder(path, segment_rows=3)
+            recorder.start()
+            for i in range(5):
+                dv = ua.DataValue(ua.Variant(float(i)))
+                dv.SourceTimestamp = datetime.fromtimestamp(1000 + i, timezone.utc)
+                recorder.record_value(ua.NodeId(i % 2, 2), dv)
+            event = FakeEvent(100)
+            event.Time = datetime.fromtimestamp(1002.5, timezone.utc)
+            recorder.event_notification(event)
+            recorder.stop()
+            handler = FakeHandler()
+            player = Player(Recording(path), [handler], [handler], speed=0)
+            player.start()
+            for _ in range(100):
+                if player.finished and player.sent == 6:
+                    break
+                time.sleep(0.01)
+            player.stop()
+            self.assertEqual([val for _, val in handler.values], [0, 1, 2, 3, 4])
+            self.assertEqual(handler.values[1][0].to_string(), "ns=2;i=1")
+            self.assertEqual([ev.Severity for ev in handler.events], [100])
+            self.assertEqual(player.position, 1004)
+
+
+class TestCli(unittest.TestCase):
+    def test_row_writer(self):
+        row = {"nodeid": async_ua.NodeId(5, 2), "value": [async_ua.LocalizedText("a"), 1.5], "status": async_ua.StatusCode(),
+               "source_timestamp": datetime.fromtimestamp(0, timezone.utc)}
+        out = io.StringIO()
+        RowWriter(out, "jsonl", ["nodeid", "value", "status", "source_timestamp"]).write(row)
+        self.assertEqual(out.getvalue(), '{"nodeid": "ns=2;i=5", "value": ["a", 1.5], "status": "Good", '
+                                         '"source_timestamp": "1970-01-01T00:00:00+00:00"}\n')
+        out = io.StringIO()
+        RowWriter(out, "csv", ["nodeid", "value"]).write(row)
+        self.assertEqual(out.getvalue().splitlines(), ['nodeid,value', 'ns=2;i=5,"[""a"", 1.5]"'])
+
+    def test_bad_status(self):
+        out = io.StringIO()
+        args = argparse.Namespace(nodes=["ns=2;i=1", "ns=2;i=2"])
+        failed = read_command(FakeReader(), args, RowWriter(out, "jsonl", VALUE_COLUMNS))
+        self.assertEqual(failed, 1)
+        self.assertEqual([json.loads(line)["status"] for line in out.getvalue().splitlines()], ["Good", "BadNodeIdUnknown"])
+
+
+class TestPhaseTimer(unittest.TestCase):
+    def test_report(self):
+        timer = PhaseTimer()
+        with timer.phase("disabled"):
+            pass
+        out = io.StringIO()
+        timer.report(out)
+        self.assertEqual(out.getvalue(), "")
+        self.assertEqual(timer.phases, [])
+        with tempfile.TemporaryDirectory() as path:
+            timer.path = os.path.join(path, "timing.json")
+            with timer.phase("outer"):
+                with timer.phase("inner"):
+                    pass
+            timer.mark("done")
+            timer.report(out)
+            with open(timer.path) as f:
+                phases = json.load(f)["phases"]
+        self.assertEqual([phase["name"] for phase in phases], ["inner", "outer", "done"])
+        self.assertLessEqual(phases[0]["duration"], phases[1]["duration"])
+        self.assertEqual(phases[2]["start"], 0)
+        self.assertEqual(out.getvalue().splitlines()[0].split(), ["Phase", "Start", "Duration"])
+
+
+class TestStartup(unittest.TestCase):
+    # seconds from starting python to a constructed main window, mostly spent importing asyncua,
+    # only checked when set in environment as it depends on the machine, like STARTUP_BUDGET=3
+    budget = float(os.environ.get("STARTUP_BUDGET", 0))
+    heavy_modules = ["pyqtgraph", "numpy", "uaclient.graphwidget", "uaclient.theme.breeze_resources"]
+
+    def test_cold_start(self):
+        code = ("import sys\n"
+                "from PyQt5.QtWidgets import QApplication\n"
+                "app = QApplication(sys.argv)\n"
+                "from uaclient.mainwindow import Window\n"
+                "window = Window()\n"
+                "print(' '.join(name for name in {} if name in sys.modules))\n").format(self.heavy_modules)
+        with tempfile.TemporaryDirectory() as config:
+            env = dict(os.environ, QT_QPA_PLATFORM="offscreen", XDG_CONFIG_HOME=config)
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            elapsed = time.perf_counter() - start
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines()[-1], "")  # heavy modules loaded at startup
+        if self.budget:
+            self.assertLess(elapsed, self.budget)
+
+
+class FakeHandler(object):
+    def __init__(self):
+        self.values = []
+        self.data = []
+        self.events = []
+
+    def datachange_notification(self, node, val, data):
+        self.values.append((node.nodeid, val))
+        self.data.append(data)
+
+    def event_notification(self, event):
+        self.events.append(event)
+
+
+class FakeEvent(object):
+    def __init__(self, severity, source="src"):
+        self.Severity = severity
+        self.SourceName = source
+        self.Extra = "extra"
+
+
+class FakeServer(object):
+    """
+    asyncua.client.ua_client.UaClient returning one variable per page,
+    node i=0 has one page and other nodes two
+    """
+
+    def __init__(self):
+        self.released = []
+        self.fail = None
+
+    def _result(self, nodeid, page):
+        result = async_ua.BrowseResult()
+        if nodeid == self.fail:
+            result.StatusCode = async_ua.StatusCode(async_ua.StatusCodes.BadNodeIdUnknown)
+            return result
+        desc = async_ua.ReferenceDescription()
+        desc.NodeId = async_ua.NodeId(nodeid.Identifier * 10 + page, 2)
+        desc.NodeClass = async_ua.NodeClass.Variable
+        desc.BrowseName = async_ua.QualifiedName(str(page))
+        result.References = [desc]
+        if nodeid.Identifier and not page:
+            result.ContinuationPoint = str(nodeid.Identifier).encode()
+        return result
+
+    async def browse(self, params):
+        return [self._result(desc.NodeId, 0) for desc in params.NodesToBrowse]
+
+    async def browse_next(self, params):
+        if params.ReleaseContinuationPoints:
+            self.released.extend(params.ContinuationPoints)
+            return []
+        return [self._result(async_ua.NodeId(int(point), 2), 1) for point in params.ContinuationPoints]
+
+
+class FakeSubscription(object):
+    def __init__(self, fail):
+        self.fail = fail
+        self.handles = []
+        self.deleted = False
+
+    async def create_monitored_items(self, requests):
+        results = []
+        for request in requests:
+            if request.ItemToMonitor.NodeId == self.fail:
+                results.append(async_ua.StatusCode(async_ua.StatusCodes.BadNodeIdUnknown))
+            else:
+                self.handles.append(len(self.handles) + 1)
+                results.append(self.handles[-1])
+        return results
+
+    async def unsubscribe(self, handle):
+        self.handles.remove(handle)
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeAioClient(object):
+    """
+    asyncua.Client creating FakeSubscriptions, monitoring fail is rejected
+    """
+
+    def __init__(self):
+        self.uaclient = FakeServer()
+        self.subscriptions = []
+        self.fail = None
+
+    async def create_subscription(self, period, handler):
+        self.subscriptions.append(FakeSubscription(self.fail))
+        return self.subscriptions[-1]
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.aio_obj = FakeAioClient()
+
+
+class FakeReader(object):
+    """
+    UaClient reading ns=2;i=2 fails
+    """
+
+    run = staticmethod(asyncio.run)
+
+    async def read_attributes_async(self, nodeids, attrs):
+        bad = async_ua.DataValue(StatusCode=async_ua.StatusCode(async_ua.StatusCodes.BadNodeIdUnknown))
+        return {async_ua.AttributeIds.Value: [bad if nodeid == async_ua.NodeId(2, 2) else async_ua.DataValue(async_ua.Variant(1.5))
+                                              for nodeid in nodeids]}
+
+    async def decode_value_async(self, val):
+        return val
+
+
+class FakeNode(object):
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+
+class FakeVariable(FakeNode):
+    def __init__(self, nodeid, name):
+        FakeNode.__init__(self, nodeid)
+        self.name = name
+
+    def read_display_name(self):
+        return ua.LocalizedText(self.name)
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,52 @@
+import logging
+
+from PyQt5.QtCore import pyqtSignal, QObject, Qt
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBridge(QObject):
+    """
+    Hand results of requests running on the client asyncio loop
+    back to the Qt event loop. Callbacks are always called in the GUI thread
+    """
+    _future_done = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self._callbacks = {}
+        self._future_done.connect(self._dispatch, type=Qt.QueuedConnection)
+
+    @property
+    def pending(self):
+        return len(self._callbacks)
+
+    def watch(self, future, callback=None, errback=None):
+        """
+        call callback with the result of future or errback with its exception
+        once the future is done
+        """
+        self._callbacks[future] = (callback, errback)
+        # called from the asyncio thread, emitting is thread safe
+        future.add_done_callback(self._future_done.emit)
+        return future
+
+    def cancel_all(self):
+        for future in list(self._callbacks):
+            future.cancel()
+        self._callbacks = {}
+
+    def _dispatch(self, future):
+        callback, errback = self._callbacks.pop(future, (None, None))
+        if future.cancelled():
+            return
+        ex = future.exception()
+        if ex is not None:
+            if errback is not None:
+                errback(ex)
+            else:
+                logger.warning("Unhandled error in asynchronous request: %s", ex)
+            return
+        if callback is not None:
+            callback(future.result())
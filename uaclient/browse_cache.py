@@ -0,0 +1,98 @@
+import logging
+import time
+from collections import OrderedDict
+
+from asyncua import ua
+
+
+logger = logging.getLogger(__name__)
+
+
+class BrowseCache(object):
+    """
+    Cache of browse results keyed by NodeId and browse parameters.
+    Entries expire after ttl seconds and least recently used entries are
+    evicted when more than max_size are stored.
+    Only used from the client loop, no locking is done
+    """
+
+    def __init__(self, max_size=20000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (time, descriptions)
+        self._keys_by_node = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stamp, descs = entry
+        if self.ttl and time.monotonic() - stamp > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return descs
+
+    def put(self, key, descs):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (time.monotonic(), descs)
+        self._keys_by_node.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_node[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_node[key[0]]
+
+    def invalidate(self, nodeid):
+        """
+        forget all browse results of nodeid
+        """
+        for key in list(self._keys_by_node.get(nodeid, ())):
+            self._remove(key)
+
+    def invalidate_child(self, nodeid):
+        """
+        forget all browse results listing nodeid
+        """
+        for key, (_, descs) in list(self._entries.items()):
+            if any(desc.NodeId == nodeid for desc in descs):
+                self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_node.clear()
+
+    def event_notification(self, event):
+        """
+        invalidate entries from a GeneralModelChangeEvent,
+        events without change details clear the whole cache
+        """
+        changes = getattr(event, "Changes", None)
+        if not changes:
+            logger.info("Model changed, clearing browse cache")
+            self.clear()
+            return
+        verbs = 0
+        for change in changes:
+            verbs |= change.Verb
+            self.invalidate(change.Affected)
+            if change.Verb & ua.ModelChangeStructureVerbMask.NodeDeleted:
+                self.invalidate_child(change.Affected)
+        # parent of an added node is only known if the reference is reported too
+        if verbs & ua.ModelChangeStructureVerbMask.NodeAdded and \
+                not verbs & ua.ModelChangeStructureVerbMask.ReferenceAdded:
+            logger.info("Node added at unknown place, clearing browse cache")
+            self.clear()
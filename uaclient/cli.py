@@ -0,0 +1,285 @@
+"""
+Command line interface of opcua-client. Without a command the GUI is started,
+commands browse, read, subscribe and dump use UaClient without Qt
+and write one row per result to stdout as JSON lines or CSV.
+Exit status is 1 when a requested node returned a bad status
+or stdout was closed, like by head
+"""
+
+# imported first so the timer also covers the other imports
+from uaclient.timing import timer, pop_timing_option, default_path
+
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+from enum import Enum
+
+from asyncua import ua
+
+from uaclient.uaclient import UaClient, MemorySettings, SubscriptionParameters
+
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("browse", "read", "subscribe", "dump")
+
+BROWSE_COLUMNS = ["parent", "nodeid", "browse_name", "display_name", "node_class", "reference_type"]
+VALUE_COLUMNS = ["nodeid", "value", "status", "source_timestamp", "server_timestamp"]
+
+
+def main(argv=None):
+    """
+    run command of argv, return exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    argv = pop_timing_option(argv)
+    timer.mark("Imports")
+    if not set(argv) & set(COMMANDS + ("-h", "--help")):
+        with timer.phase("Import GUI modules"):
+            from uaclient.mainwindow import main as gui_main
+        gui_main()
+        return 0
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    uaclient = UaClient(MemorySettings())
+    uaclient.security_mode = args.security_mode
+    uaclient.security_policy = args.security_policy
+    uaclient.user_certificate_path = args.certificate
+    uaclient.user_private_key_path = args.private_key
+    uaclient.application_certificate_path = args.application_certificate
+    uaclient.application_private_key_path = args.application_private_key
+    with timer.phase("Connect"):
+        uaclient.run(uaclient.connect_async(args.url))
+    status = 0
+    try:
+        if args.load_types:
+            with timer.phase("Load types"):
+                uaclient.run(uaclient.load_types_async())
+        writer = RowWriter(sys.stdout, args.format, _columns(args))
+        with timer.phase("Command " + args.command):
+            failed = args.func(uaclient, args, writer)
+        if failed:
+            logger.warning("%s nodes returned a bad status", failed)
+            status = 1
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # reader is gone, python would fail again flushing stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        status = 1
+    finally:
+        uaclient.disconnect()
+        timer.report()
+    return status
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="opcua-client", description="OPC-UA client, the GUI is started when no command is given",
+                                     epilog="--timing[=FILE] prints durations of startup and connection phases to stderr "
+                                            "and saves them as JSON, by default to {}. "
+                                            "Exit status is 1 when a requested node returned a bad status".format(default_path()))
+    parser.add_argument("-u", "--url", default="opc.tcp://localhost:4840", help="server url, default %(default)s")
+    parser.add_argument("-f", "--format", choices=["jsonl", "csv"], default="jsonl", help="output format, default %(default)s")
+    parser.add_argument("--security-mode", choices=["Sign", "SignAndEncrypt"])
+    parser.add_argument("--security-policy", help="for example Basic256Sha256")
+    parser.add_argument("--certificate", help="user certificate")
+    parser.add_argument("--private-key", help="private key of user certificate")
+    parser.add_argument("--application-certificate")
+    parser.add_argument("--application-private-key")
+    parser.add_argument("--load-types", action="store_true", help="load all custom types of server before running command")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    browse = commands.add_parser("browse", help="list children of nodes")
+    browse.add_argument("nodes", nargs="*", default=["i=85"], help="NodeIds, default Objects folder")
+    browse.add_argument("-d", "--depth", type=int, default=1, help="levels to browse, default %(default)s")
+    browse.set_defaults(func=browse_command)
+
+    read = commands.add_parser("read", help="read value of nodes")
+    read.add_argument("nodes", nargs="+", help="NodeIds")
+    read.set_defaults(func=read_command)
+
+    subscribe = commands.add_parser("subscribe", help="print data changes of nodes until interrupted")
+    subscribe.add_argument("nodes", nargs="+", help="NodeIds")
+    subscribe.add_argument("-i", "--sampling-interval", type=float, default=500, help="ms, default %(default)s")
+    subscribe.add_argument("-t", "--duration", type=float, default=0, help="seconds, 0 runs until interrupted")
+    subscribe.add_argument("-n", "--count", type=int, default=0, help="stop after count notifications, 0 for no limit")
+    subscribe.set_defaults(func=subscribe_command)
+
+    dump = commands.add_parser("dump", help="read values of all variables below nodes")
+    dump.add_argument("nodes", nargs="*", default=["i=85"], help="NodeIds, default Objects folder")
+    dump.add_argument("-m", "--max-count", type=int, default=10000, help="maximum number of variables, default %(default)s")
+    dump.set_defaults(func=dump_command)
+    return parser
+
+
+def _columns(args):
+    if args.command == "browse":
+        return BROWSE_COLUMNS
+    if args.command == "dump":
+        return ["nodeid", "display_name"] + VALUE_COLUMNS[1:]
+    return VALUE_COLUMNS
+
+
+class RowWriter(object):
+    """
+    write rows, dicts with given columns, as JSON lines or CSV.
+    Output is flushed after each row so it can be piped while streaming
+    """
+
+    def __init__(self, out, fmt, columns):
+        self.out = out
+        self.fmt = fmt
+        self.columns = columns
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.writer(out)
+            self._csv.writerow(columns)
+
+    def write(self, row):
+        if self._csv is None:
+            self.out.write(json.dumps({col: to_json(row.get(col)) for col in self.columns}) + "\n")
+        else:
+            self._csv.writerow([_csv_field(row.get(col)) for col in self.columns])
+        self.out.flush()
+
+
+def to_json(val):
+    """
+    convert a value read from server to something json can encode
+    """
+    if isinstance(val, Enum):
+        return val.name
+    if val is None or isinstance(val, (bool, int, float, str)):
+        return val
+    if isinstance(val, (list, tuple)):
+        return [to_json(v) for v in val]
+    if isinstance(val, datetime):
+        return val.isoformat()
+    if isinstance(val, (bytes, bytearray)):
+        return val.hex()
+    if isinstance(val, (ua.NodeId, ua.QualifiedName)):
+        return val.to_string()
+    if isinstance(val, ua.LocalizedText):
+        return val.Text
+    if isinstance(val, ua.StatusCode):
+        return val.name
+    if hasattr(val, "__dataclass_fields__"):
+        return {name: to_json(getattr(val, name)) for name in val.__dataclass_fields__}
+    return str(val)
+
+
+def _csv_field(val):
+    val = to_json(val)
+    if isinstance(val, (list, dict)):
+        return json.dumps(val)
+    return val
+
+
+def _is_bad(dv):
+    return dv.StatusCode is not None and dv.StatusCode.is_bad()
+
+
+def _value_row(nodeid, dv, val):
+    return {"nodeid": nodeid, "value": val, "status": dv.StatusCode,
+            "source_timestamp": dv.SourceTimestamp, "server_timestamp": dv.ServerTimestamp}
+
+
+# commands return number of nodes with a bad status
+
+
+def browse_command(uaclient, args, writer):
+    level = [ua.NodeId.from_string(nodeid) for nodeid in args.nodes]
+    for _ in range(args.depth):
+        next_level = []
+        for parent, descs in uaclient.run(uaclient.browse_many_async(level)).items():
+            for desc in descs:
+                writer.write({"parent": parent, "nodeid": desc.NodeId, "browse_name": desc.BrowseName,
+                              "display_name": desc.DisplayName, "node_class": desc.NodeClass,
+                              "reference_type": desc.ReferenceTypeId})
+                next_level.append(desc.NodeId)
+        level = next_level
+    return 0
+
+
+def read_command(uaclient, args, writer):
+    nodeids = [ua.NodeId.from_string(nodeid) for nodeid in args.nodes]
+    failed = 0
+    for nodeid, dv, val in uaclient.run(_read_values(uaclient, nodeids)):
+        writer.write(_value_row(nodeid, dv, val))
+        failed += _is_bad(dv)
+    return failed
+
+
+async def _read_values(uaclient, nodeids):
+    columns = await uaclient.read_attributes_async(nodeids, [ua.AttributeIds.Value])
+    results = []
+    for nodeid, dv in zip(nodeids, columns[ua.AttributeIds.Value]):
+        val = await uaclient.decode_value_async(dv.Value.Value) if dv.Value is not None else None
+        results.append((nodeid, dv, val))
+    return results
+
+
+def dump_command(uaclient, args, writer):
+    nodeids = [ua.NodeId.from_string(nodeid) for nodeid in args.nodes]
+    descs = uaclient.run(uaclient.collect_variables_async(nodeids, args.max_count))
+    names = {desc.NodeId: desc.DisplayName for desc in descs}
+    failed = 0
+    for nodeid, dv, val in uaclient.run(_read_values(uaclient, list(names))):
+        row = _value_row(nodeid, dv, val)
+        row["display_name"] = names[nodeid]
+        writer.write(row)
+        failed += _is_bad(dv)
+    return failed
+
+
+class _QueueHandler(object):
+    """
+    pass data changes from client loop to main thread
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def datachange_notification(self, node, val, data):
+        self.queue.put((node.nodeid, data.monitored_item.Value, val))
+
+
+def subscribe_command(uaclient, args, writer):
+    nodes = [uaclient.get_node(nodeid) for nodeid in args.nodes]
+    handler = _QueueHandler()
+    params = SubscriptionParameters(args.sampling_interval)
+    handles = uaclient.run(uaclient.subscribe_datachange_many_async(nodes, handler, params))
+    failed = set()
+    for node, handle in zip(nodes, handles):
+        if isinstance(handle, ua.StatusCode):
+            logger.warning("Could not subscribe to %s: %s", node, handle)
+            failed.add(node.nodeid)
+    end = time.monotonic() + args.duration if args.duration else None
+    count = 0
+    try:
+        while end is None or time.monotonic() < end:
+            try:
+                nodeid, dv, val = handler.queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            writer.write(_value_row(nodeid, dv, val))
+            if _is_bad(dv):
+                failed.add(nodeid)
+            count += 1
+            if args.count and count >= args.count:
+                break
+    except KeyboardInterrupt:
+        pass  # usual way to stop
+    return len(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import time
+from array import array
+from datetime import datetime, timezone
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from asyncua import ua
+
+
+class DataChangeModel(QAbstractTableModel):
+    """
+    Table of subscribed nodes stored column wise.
+    Values are kept raw and only formatted when a view asks for them
+    """
+
+    headers = ["DisplayName", "Value", "Timestamp", "Status"]
+
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self._init_columns()
+
+    def _init_columns(self):
+        self._rows = {}  # NodeId -> row
+        self._nodes = []
+        self._names = []
+        self._values = []
+        self._has_value = array('b')
+        self._status = array('I')
+        self._timestamps = array('d')
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._nodes)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return QAbstractTableModel.headerData(self, section, orientation, role)
+
+    def flags(self, idx):
+        if not idx.isValid():
+            return Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def mimeTypes(self):
+        return ["text/plain"]
+
+    def supportedDropActions(self):
+        return Qt.CopyAction | Qt.MoveAction
+
+    def data(self, idx, role=Qt.DisplayRole):
+        if not idx.isValid():
+            return None
+        row = idx.row()
+        col = idx.column()
+        if role == Qt.UserRole:
+            return self._nodes[row]
+        if role != Qt.DisplayRole:
+            return None
+        if col == 0:
+            return self._names[row]
+        if not self._has_value[row]:
+            return "No Data yet" if col == 1 else ""
+        if col == 1:
+            return str(self._values[row])
+        if col == 2:
+            return datetime.fromtimestamp(self._timestamps[row], timezone.utc).isoformat()
+        return ua.StatusCode(self._status[row]).name
+
+    def clear(self):
+        self.beginResetModel()
+        self._init_columns()
+        self.endResetModel()
+
+    def __contains__(self, nodeid):
+        return nodeid in self._rows
+
+    def node(self, nodeid):
+        return self._nodes[self._rows[nodeid]]
+
+    def add_nodes(self, nodes, names=None):
+        """
+        append a row for each node in one model operation
+        """
+        nodes = [node for node in nodes if node.nodeid not in self._rows]
+        if not nodes:
+            return
+        if names is None:
+            names = [node.nodeid.to_string() for node in nodes]
+        first = len(self._nodes)
+        self.beginInsertRows(QModelIndex(), first, first + len(nodes) - 1)
+        for row, node in enumerate(nodes, start=first):
+            self._rows[node.nodeid] = row
+        self._nodes.extend(nodes)
+        self._names.extend(names)
+        self._values.extend([None] * len(nodes))
+        self._has_value.extend([0] * len(nodes))
+        self._status.extend([0] * len(nodes))
+        self._timestamps.extend([0.] * len(nodes))
+        self.endInsertRows()
+
+    def remove_node(self, nodeid):
+        row = self._rows.pop(nodeid, None)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        for column in (self._nodes, self._names, self._values, self._has_value, self._status, self._timestamps):
+            del column[row]
+        for node in self._nodes[row:]:
+            self._rows[node.nodeid] -= 1
+        self.endRemoveRows()
+
+    def remove_nodes(self, nodeids):
+        """
+        remove many rows in one model operation
+        """
+        drop = set(nodeid for nodeid in nodeids if nodeid in self._rows)
+        if not drop:
+            return
+        keep = [row for row, node in enumerate(self._nodes) if node.nodeid not in drop]
+        self.beginResetModel()
+        self._nodes = [self._nodes[row] for row in keep]
+        self._names = [self._names[row] for row in keep]
+        self._values = [self._values[row] for row in keep]
+        self._has_value = array('b', (self._has_value[row] for row in keep))
+        self._status = array('I', (self._status[row] for row in keep))
+        self._timestamps = array('d', (self._timestamps[row] for row in keep))
+        self._rows = {node.nodeid: row for row, node in enumerate(self._nodes)}
+        self.endResetModel()
+
+    def set_name(self, nodeid, name):
+        row = self._rows.get(nodeid)
+        if row is not None:
+            self._names[row] = name
+            idx = self.index(row, 0)
+            self.dataChanged.emit(idx, idx, [Qt.DisplayRole])
+
+    def update(self, pending):
+        """
+        apply a batch of notifications, a dict NodeId -> (node, val, data),
+        views are notified once for whole batch
+        """
+        first = last = None
+        for nodeid, (node, val, data) in pending.items():
+            row = self._rows.get(nodeid)
+            if row is None:
+                continue  # notification arriving after unsubscribe
+            dv = data.monitored_item.Value
+            stamp = dv.SourceTimestamp or dv.ServerTimestamp
+            self._values[row] = val
+            self._has_value[row] = 1
+            self._status[row] = dv.StatusCode.value if dv.StatusCode is not None else 0
+            self._timestamps[row] = stamp.timestamp() if stamp else time.time()
+            if first is None or row < first:
+                first = row
+            if last is None or row > last:
+                last = row
+        if first is not None:
+            self.dataChanged.emit(self.index(first, 1), self.index(last, len(self.headers) - 1), [Qt.DisplayRole])
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+def visible_slice(x, x_min, x_max):
+    """
+    return slice of sorted x between x_min and x_max, plus one sample
+    on each side so lines reach the border of the view
+    """
+    start = max(int(np.searchsorted(x, x_min, side="left")) - 1, 0)
+    stop = min(int(np.searchsorted(x, x_max, side="right")) + 1, len(x))
+    return slice(start, stop)
+
+
+def minmax_decimate(x, y, bins):
+    """
+    reduce x, y to at most 2 * bins points keeping minimum and maximum
+    of every bin in their original order, so peaks stay visible.
+    Bins containing only NaN keep a NaN to show gaps
+    """
+    n = len(y)
+    if n <= 2 * bins:
+        return x, y
+    size = -(-n // bins)  # ceil
+    full = n // size * size
+    idx = _minmax_index(y[:full], size)
+    if full < n:
+        idx = np.concatenate([idx, full + _minmax_index(y[full:], n - full)])
+    return x[idx], y[idx]
+
+
+def _minmax_index(y, size):
+    """
+    indices of minimum and maximum of each bin of size samples, len(y) is a multiple of size
+    """
+    rows = y.reshape(-1, size)
+    nans = np.isnan(rows)
+    if nans.any():
+        lows = np.where(nans, np.inf, rows).argmin(axis=1)
+        highs = np.where(nans, -np.inf, rows).argmax(axis=1)
+    else:
+        lows = rows.argmin(axis=1)
+        highs = rows.argmax(axis=1)
+    offsets = np.arange(len(rows)) * size
+    return np.sort(np.stack([lows + offsets, highs + offsets], axis=1), axis=1).ravel()
+
+
+class MinMaxCache(object):
+    """
+    min/max decimation of samples which are only appended, or prepended,
+    like the view of a RingBuffer. Bins are aligned to the absolute index
+    of samples, so complete bins are kept and each call only decimates
+    samples added since the last one and the partial bins at both ends.
+    Bin size is a power of two, so it only changes when the number of
+    samples doubles or halves and the cache is rebuilt
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.first = 0  # bin number of first cached bin
+        self.x = np.zeros(0)  # minimum and maximum of each cached bin, in order
+        self.y = np.zeros(0)
+
+    def decimate(self, x, y, first_index, bins):
+        """
+        reduce x, y to at most about 4 * bins points like minmax_decimate,
+        first_index is the absolute index of x[0], see RingBuffer.total
+        """
+        n = len(y)
+        if n <= 2 * bins:
+            return x, y
+        size = 1 << int(np.ceil(np.log2(n / bins)))
+        lo = -(-first_index // size)  # first complete bin
+        hi = (first_index + n) // size  # end of complete bins
+        end = self.first + len(self.y) // 2
+        if size != self.size or end > hi or end < lo:
+            self.size = size
+            self.first = end = lo
+            self.x = self.y = np.zeros(0)
+        if self.first < lo:
+            # evicted from buffer
+            drop = 2 * (lo - self.first)
+            self.x, self.y = self.x[drop:], self.y[drop:]
+            self.first = lo
+        elif lo < self.first:
+            # prepended, history for example
+            x_new, y_new = self._bins(x, y, first_index, lo, self.first)
+            self.x, self.y = np.concatenate([x_new, self.x]), np.concatenate([y_new, self.y])
+            self.first = lo
+        if end < hi:
+            x_new, y_new = self._bins(x, y, first_index, end, hi)
+            self.x, self.y = np.concatenate([self.x, x_new]), np.concatenate([self.y, y_new])
+        # partial bins at both ends are decimated on every call
+        head = min(lo * size - first_index, n)
+        tail = max(hi * size - first_index, head)
+        parts = []
+        if head:
+            parts.append(_minmax_index(y[:head], head))
+        parts.append(None)
+        if tail < n:
+            parts.append(tail + _minmax_index(y[tail:], n - tail))
+        xs = [self.x if idx is None else x[idx] for idx in parts]
+        ys = [self.y if idx is None else y[idx] for idx in parts]
+        return np.concatenate(xs), np.concatenate(ys)
+
+    def _bins(self, x, y, first_index, start, stop):
+        begin = start * self.size - first_index
+        idx = begin + _minmax_index(y[begin:stop * self.size - first_index], self.size)
+        return x[idx], y[idx]
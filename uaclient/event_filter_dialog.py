@@ -0,0 +1,72 @@
+from PyQt5.QtWidgets import QDialog, QFormLayout, QSpinBox, QLineEdit, QPlainTextEdit, QPushButton, QDialogButtonBox
+
+from asyncua import ua
+
+from uaclient.uaclient import EventFilterParameters
+
+
+class EventFilterDialog(QDialog):
+    """
+    Edit the event filter sent to server when subscribing to events.
+    Event types and source nodes are given as one NodeId per line
+    """
+
+    def __init__(self, parent, params, current_node=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Event Filter")
+        self.current_node = current_node
+        layout = QFormLayout(self)
+
+        self.typesTextEdit = QPlainTextEdit()
+        self.typesTextEdit.setToolTip("Only events of these types or their subtypes, all events if empty")
+        layout.addRow("Event types", self.typesTextEdit)
+
+        self.severitySpinBox = QSpinBox()
+        self.severitySpinBox.setRange(0, 1000)
+        layout.addRow("Minimum severity", self.severitySpinBox)
+
+        self.sourcesTextEdit = QPlainTextEdit()
+        self.sourcesTextEdit.setToolTip("Only events with one of these SourceNode, all events if empty")
+        layout.addRow("Source nodes", self.sourcesTextEdit)
+        if current_node is not None:
+            self.addTypeButton = QPushButton("Add selected node to event types")
+            self.addTypeButton.clicked.connect(lambda: self._add_current_node(self.typesTextEdit))
+            self.addSourceButton = QPushButton("Add selected node to source nodes")
+            self.addSourceButton.clicked.connect(lambda: self._add_current_node(self.sourcesTextEdit))
+            layout.addRow("", self.addTypeButton)
+            layout.addRow("", self.addSourceButton)
+
+        self.fieldsLineEdit = QLineEdit()
+        self.fieldsLineEdit.setPlaceholderText("All fields of event types")
+        self.fieldsLineEdit.setToolTip("Comma separated browse paths of fields to select, {} are always selected".format(
+            ", ".join(EventFilterParameters.base_fields)))
+        layout.addRow("Fields", self.fieldsLineEdit)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+        self.params = params
+
+    def _add_current_node(self, edit):
+        edit.appendPlainText(self.current_node.nodeid.to_string())
+
+    @property
+    def params(self):
+        fields = [field.strip() for field in self.fieldsLineEdit.text().split(",")]
+        return EventFilterParameters(_nodeids(self.typesTextEdit.toPlainText()),
+                                     self.severitySpinBox.value(),
+                                     _nodeids(self.sourcesTextEdit.toPlainText()),
+                                     [field for field in fields if field])
+
+    @params.setter
+    def params(self, params):
+        self.typesTextEdit.setPlainText("\n".join(nodeid.to_string() for nodeid in params.event_types))
+        self.severitySpinBox.setValue(params.min_severity)
+        self.sourcesTextEdit.setPlainText("\n".join(nodeid.to_string() for nodeid in params.source_nodes))
+        self.fieldsLineEdit.setText(", ".join(params.fields))
+
+
+def _nodeids(text):
+    return [ua.NodeId.from_string(line.strip()) for line in text.splitlines() if line.strip()]
@@ -0,0 +1,211 @@
+from collections import deque
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from asyncua import ua
+
+
+class EventModel(QAbstractTableModel):
+    """
+    Last events received, kept as records in a ring buffer of fixed capacity.
+    There is one column per event field, fields seen for the first time add columns.
+    Oldest events are evicted when buffer is full and values are
+    only formatted when a view asks for them.
+    Events are indexed by source and type so filtering on them
+    does not scan the whole buffer
+    """
+
+    fields = ["Time", "Severity", "SourceName", "EventType", "Message"]
+
+    def __init__(self, capacity=10000, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.capacity = capacity
+        self.evicted = 0
+        self._init_buffer()
+
+    def _init_buffer(self):
+        self.columns = list(self.fields)
+        self._column_index = {name: col for col, name in enumerate(self.columns)}
+        self._records = [None] * self.capacity
+        self._first_seq = 0  # sequence number of oldest event
+        self._next_seq = 0
+        self._by_source = {}  # SourceName -> deque of sequence numbers
+        self._by_type = {}  # EventType -> deque of sequence numbers
+        self._filter = (None, None)
+        self._visible = None  # sequence numbers matching filter, None if not filtering
+        self._visible_start = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._visible is None:
+            return self._next_seq - self._first_seq
+        return len(self._visible) - self._visible_start
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return QAbstractTableModel.headerData(self, section, orientation, role)
+
+    def flags(self, idx):
+        if not idx.isValid():
+            return Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def mimeTypes(self):
+        return ["text/plain"]
+
+    def supportedDropActions(self):
+        return Qt.CopyAction | Qt.MoveAction
+
+    @property
+    def sources(self):
+        return list(self._by_source)
+
+    @property
+    def event_types(self):
+        return list(self._by_type)
+
+    def record(self, row):
+        """
+        field values of event at row, in the order of columns
+        """
+        if self._visible is None:
+            seq = self._first_seq + row
+        else:
+            seq = self._visible[self._visible_start + row]
+        return self._records[seq % self.capacity]
+
+    def data(self, idx, role=Qt.DisplayRole):
+        if not idx.isValid() or idx.row() >= self.rowCount():
+            return None
+        record = self.record(idx.row())
+        val = record[idx.column()] if idx.column() < len(record) else None
+        if role == Qt.UserRole:
+            return val
+        if role != Qt.DisplayRole or val is None:
+            return None
+        if isinstance(val, ua.LocalizedText):
+            return val.Text
+        if isinstance(val, ua.NodeId):
+            return val.to_string()
+        if hasattr(val, "isoformat"):
+            return val.isoformat()
+        return str(val)
+
+    def clear(self):
+        self.beginResetModel()
+        self._init_buffer()
+        self.evicted = 0
+        self.endResetModel()
+
+    def set_filter(self, source=None, event_type=None):
+        """
+        only show events from source and of event_type, None matches everything
+        """
+        self.beginResetModel()
+        self._filter = (source, event_type)
+        self._visible_start = 0
+        if source is None and event_type is None:
+            self._visible = None
+        else:
+            candidates = []
+            if source is not None:
+                candidates.append(self._by_source.get(source, ()))
+            if event_type is not None:
+                candidates.append(self._by_type.get(event_type, ()))
+            # walk the shortest index and check the other condition on records
+            seqs = min(candidates, key=len)
+            self._visible = [seq for seq in seqs if self._matches(self._records[seq % self.capacity])]
+        self.endResetModel()
+
+    def _matches(self, record):
+        source, event_type = self._filter
+        return (source is None or record[2] == source) and (event_type is None or record[3] == event_type)
+
+    def append_events(self, events):
+        """
+        append a batch of events, evicting oldest ones if needed
+        """
+        if not events:
+            return
+        if len(events) > self.capacity:
+            self.evicted += len(events) - self.capacity
+            events = events[-self.capacity:]
+        self._add_columns(events)
+        evict = self._next_seq - self._first_seq + len(events) - self.capacity
+        if evict > 0:
+            self._evict(evict)
+        records = [[getattr(ev, name, None) for name in self.columns] for ev in events]
+        if self._visible is None:
+            shown = len(records)
+        else:
+            matched = [self._next_seq + i for i, record in enumerate(records) if self._matches(record)]
+            shown = len(matched)
+        first_row = self.rowCount()
+        if shown:
+            self.beginInsertRows(QModelIndex(), first_row, first_row + shown - 1)
+        for record in records:
+            self._store(record)
+        if self._visible is not None:
+            self._visible.extend(matched)
+        if shown:
+            self.endInsertRows()
+
+    def _add_columns(self, events):
+        new = []
+        for ev in events:
+            internal = getattr(ev, "internal_properties", ())
+            for name in vars(ev):
+                if name not in self._column_index and name not in internal and name not in new:
+                    new.append(name)
+        if not new:
+            return
+        first = len(self.columns)
+        self.beginInsertColumns(QModelIndex(), first, first + len(new) - 1)
+        for name in new:
+            self._column_index[name] = len(self.columns)
+            self.columns.append(name)
+        self.endInsertColumns()
+
+    def _store(self, record):
+        seq = self._next_seq
+        self._records[seq % self.capacity] = record
+        self._by_source.setdefault(record[2], deque()).append(seq)
+        self._by_type.setdefault(record[3], deque()).append(seq)
+        self._next_seq += 1
+
+    def _evict(self, count):
+        last_seq = self._first_seq + count
+        if self._visible is None:
+            removed = count
+        else:
+            end = self._visible_start
+            while end < len(self._visible) and self._visible[end] < last_seq:
+                end += 1
+            removed = end - self._visible_start
+        if removed:
+            self.beginRemoveRows(QModelIndex(), 0, removed - 1)
+        for seq in range(self._first_seq, last_seq):
+            record = self._records[seq % self.capacity]
+            self._records[seq % self.capacity] = None
+            # evicted events are always the oldest entries of their indexes
+            for index, key in ((self._by_source, record[2]), (self._by_type, record[3])):
+                seqs = index[key]
+                seqs.popleft()
+                if not seqs:
+                    del index[key]
+        self._first_seq = last_seq
+        self.evicted += count
+        if self._visible is not None:
+            self._visible_start += removed
+            if self._visible_start > len(self._visible) // 2:
+                del self._visible[:self._visible_start]
+                self._visible_start = 0
+        if removed:
+            self.endRemoveRows()
@@ -1,18 +1,25 @@
 #! /usr/bin/env python3
 
 import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from PyQt5.QtCore import QTimer, Qt
-from PyQt5.QtWidgets import QLabel
+from PyQt5.QtWidgets import QLabel, QComboBox, QSpinBox
 
 from asyncua import ua
 from asyncua.sync import SyncNode
 
-from uawidgets.utils import trycatchslot
+
+from uaclient.uaclient import SubscriptionParameters
 
 use_graph = True
 try:
     import pyqtgraph as pg
     import numpy as np
+    from uaclient.ring_buffer import RingBuffer
+    from uaclient.decimation import MinMaxCache, minmax_decimate, visible_slice
 except ImportError:
     print("pyqtgraph or numpy are not installed, use of graph feature disabled")
     use_graph = False
@@ -25,11 +32,51 @@ if use_graph:
 logger = logging.getLogger(__name__)
 
 
+class GraphDataHandler(object):
+    """
+    Collect data change notifications of graph channels.
+    Every sample is kept, so all values queued on server are plotted
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._history = []
+
+    def datachange_notification(self, node, val, data):
+        dv = data.monitored_item.Value
+        stamp = dv.SourceTimestamp or dv.ServerTimestamp
+        with self._lock:
+            self._pending.append((node.nodeid, stamp.timestamp() if stamp else time.time(), val, dv.StatusCode))
+
+    def take_pending(self):
+        """
+        return (NodeId, timestamp, value, status) of samples received since last call
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def add_history(self, generation, nodeid, stamps, values):
+        with self._lock:
+            self._history.append((generation, nodeid, stamps, values))
+
+    def take_history(self):
+        """
+        return (generation, NodeId, timestamps, values) of history chunks received since last call
+        """
+        with self._lock:
+            history, self._history = self._history, []
+        return history
+
+
 class GraphUI(object):
 
     # use tango color schema (public domain)
     colorCycle = ['#4e9a06ff', '#ce5c00ff', '#3465a4ff', '#75507bff', '#cc0000ff', '#edd400ff']
     acceptedDatatypes = ['Decimal128', 'Double', 'Float', 'Integer', 'UInteger']
+    modes = ["Polling", "Subscription"]
+    arrayModes = ["Waterfall", "Traces"]
 
     def __init__(self, window, uaclient):
         self.window = window
@@ -40,96 +87,492 @@ class GraphUI(object):
             self.window.ui.graphLayout.addWidget(QLabel("pyqtgraph or numpy not installed"))
             return
         self._node_list = []  # holds the nodes to poll
-        self._channels = []  # holds the actual data
+        self._channels = []  # holds the actual data, one RingBuffer per node
+        self._times = []  # timestamps of samples in channels, one RingBuffer per node
         self._curves = []  # holds the curve objects
-        self.pw = pg.PlotWidget(name='Plot1')
+        self.pw = pg.PlotWidget(name='Plot1', axisItems={'bottom': pg.DateAxisItem()})
         self.pw.showGrid(x=True, y=True, alpha=0.3)
         self.legend = self.pw.addLegend()
         self.window.ui.graphLayout.addWidget(self.pw)
+        # curves get at most two points per pixel of the visible range,
+        # recomputed when data changes or the view is zoomed or panned
+        self._dirty = set()  # channels to redraw
+        # decimated bins of whole channels, so following new data only decimates what was appended
+        self._decimated = []  # one MinMaxCache per channel
+        self._render_timer = QTimer()
+        self._render_timer.setSingleShot(True)
+        self._render_timer.setInterval(int(1000 / float(self.window.settings.value("graph_refresh_rate", 10))))
+        self._render_timer.timeout.connect(self._render)
+        self.pw.getViewBox().sigXRangeChanged.connect(self._view_changed)
 
-        self.window.ui.actionAddToGraph.triggered.connect(self._add_node_to_channel)
-        self.window.ui.actionRemoveFromGraph.triggered.connect(self._remove_node_from_channel)
+        # array variables get a plot of their own, a waterfall of the last
+        # array_rows values or the last array_traces values drawn over each other
+        self._array_nodes = []
+        self._array_channels = []  # 2-D RingBuffer per node, created with first value
+        self._array_plots = []
+        self._array_images = []
+        self._array_curves = []  # list of trace curves per node
+        self._array_dirty = set()
+        self._array_rows = int(self.window.settings.value("array_rows", 500))
+        self._array_traces = int(self.window.settings.value("array_traces", 5))
+        self.arrayWidget = pg.GraphicsLayoutWidget()
+        self.arrayWidget.hide()
+        self.window.ui.graphLayout.addWidget(self.arrayWidget)
 
-        # populate contextual menu
-        self.window.ui.treeView.addAction(self.window.ui.actionAddToGraph)
-        self.window.ui.treeView.addAction(self.window.ui.actionRemoveFromGraph)
+        self._stats_label = QLabel()
+        self.window.ui.graphLayout.addWidget(self._stats_label)
+        self._polling = False  # a Read request is in flight
+        self._generation = 0  # increased when buffers are replaced
+        self.missed_ticks = 0
+
+        # in subscription mode samples come from monitored items and are plotted at refresh rate
+        self.modeComboBox = QComboBox()
+        self.modeComboBox.addItems(self.modes)
+        self.modeComboBox.setCurrentText(self.window.settings.value("graph_mode", "Polling"))
+        self.window.ui.horizontalLayout.insertWidget(0, self.modeComboBox)
+        self.arrayModeComboBox = QComboBox()
+        self.arrayModeComboBox.addItems(self.arrayModes)
+        self.arrayModeComboBox.setCurrentText(self.window.settings.value("graph_array_mode", "Waterfall"))
+        self.arrayModeComboBox.currentTextChanged.connect(self._array_mode_changed)
+        self.window.ui.horizontalLayout.insertWidget(1, self.arrayModeComboBox)
+        # channels can be backfilled from server history when added
+        self.historySpinBox = QSpinBox()
+        self.historySpinBox.setRange(0, 60 * 24 * 7)
+        self.historySpinBox.setSpecialValueText("No history")
+        self.historySpinBox.setSuffix(" min of history")
+        self.historySpinBox.setValue(int(self.window.settings.value("graph_history_minutes", 0)))
+        self.window.ui.horizontalLayout.insertWidget(self.window.ui.horizontalLayout.count() - 1, self.historySpinBox)
+        self._history_chunk = int(self.window.settings.value("history_values_per_request", 10000))
+        self._handler = GraphDataHandler()
+        self._subscribed_nodes = []
+        self._replay_nodes = []  # channels of a recording being replayed
+        self._flush_timer = QTimer()
+        self._flush_timer.setInterval(int(1000 / float(self.window.settings.value("refresh_rate", 30))))
+        self._flush_timer.timeout.connect(self._flush)
 
         # connect Apply button
         self.window.ui.buttonApply.clicked.connect(self.restartTimer)
         self.restartTimer()
 
-    def restartTimer(self):
-        # stop current timer, if it exists
-        if hasattr(self, 'timer') and self.timer.isActive():
-            self.timer.stop()
+    @property
+    def subscription_mode(self):
+        return self.modeComboBox.currentText() == "Subscription"
 
-        # define the number of polls displayed in graph
-        self.N = self.window.ui.spinBoxNumberOfPoints.value()
-        self.ts = np.arange(self.N)
+    def restartTimer(self):
+        self._stop_sampling()
+        self.window.settings.setValue("graph_mode", self.modeComboBox.currentText())
+        self.window.settings.setValue("graph_history_minutes", self.historySpinBox.value())
+        self.reset_channels()
         # define the poll intervall
         self.intervall = self.window.ui.spinBoxIntervall.value() * 1000
 
-        # overwrite current channel buffers with zeros of current length and add to curves again
-        for i, channel in enumerate(self._channels):
-            self._channels[i] = np.zeros(self.N)
-            self._curves[i].setData(self._channels[i])
-
+        self._flush_timer.start()
+        if self._replay_nodes:
+            return  # samples come from the player
+        for node in self._node_list:
+            self._backfill(node)
+        if self.subscription_mode:
+            for node in self._node_list + self._array_nodes:
+                self._subscribe(node)
+            return
         # starting new timer
         self.timer = QTimer()
         self.timer.setInterval(self.intervall)
         self.timer.timeout.connect(self.pushtoGraph)
         self.timer.start()
 
-    @trycatchslot
-    def _add_node_to_channel(self, node=None):
+    def _stop_sampling(self):
+        # stop current timer, if it exists
+        if hasattr(self, 'timer') and self.timer.isActive():
+            self.timer.stop()
+        self._flush_timer.stop()
+        self._unsubscribe_all()
+
+    def reset_channels(self):
+        """
+        replace channel buffers with empty ones of current length
+        """
+        if not use_graph:
+            return
+        # define the number of polls displayed in graph
+        self.N = self.window.ui.spinBoxNumberOfPoints.value()
+        self._generation += 1
+        self._handler.take_pending()
+        for i, channel in enumerate(self._channels):
+            self._channels[i] = RingBuffer(self.N)
+            self._times[i] = RingBuffer(self.N)
+            self._decimated[i] = MinMaxCache()
+            self._curves[i].setData([], [])
+        for i, channel in enumerate(self._array_channels):
+            if channel is not None:
+                channel.clear()
+            self._array_dirty.add(i)
+
+    def start_replay(self, nodes):
+        """
+        stop sampling the server and plot nodes of a recording instead,
+        return handler the player sends their values to
+        """
+        if not use_graph:
+            return None
+        self._stop_sampling()
+        self._replay_nodes = list(nodes)
+        for node in self._replay_nodes:
+            self._add_scalar_channel(node, node.nodeid.to_string())
+        self._flush_timer.start()
+        return self._handler
+
+    def stop_replay(self):
+        if not use_graph:
+            return
+        for node in self._replay_nodes:
+            self._remove_scalar_channel(node)
+        self._replay_nodes = []
+        self.restartTimer()
+
+    def _subscription_parameters(self):
+        # server samples at default rate and queues samples until next publish
+        default = self.uaclient.subscription_parameters
+        sampling = default.sampling_interval
+        queue_size = max(1, int(math.ceil(self.intervall / sampling))) if sampling else 0
+        return SubscriptionParameters(sampling, queue_size, True, default.deadband_type, default.deadband_value,
+                                      publishing_interval=self.intervall)
+
+    def _subscribe(self, node):
+        if not self.uaclient.client:
+            return
+        self._subscribed_nodes.append(node)
+        self.window.run_async(self.uaclient.subscribe_datachange_async(node, self._handler, self._subscription_parameters()),
+                              errback=lambda ex: self._subscribe_failed(node, ex))
+
+    def _subscribe_failed(self, node, ex):
+        if node in self._subscribed_nodes:
+            self._subscribed_nodes.remove(node)
+        self.show_error(ex)
+
+    def _unsubscribe(self, node):
+        if node in self._subscribed_nodes:
+            self._subscribed_nodes.remove(node)
+            self.window.run_async(self.uaclient.unsubscribe_datachange_async(node, self._handler), errback=logger.warning)
+
+    def _unsubscribe_all(self):
+        for node in list(self._subscribed_nodes):
+            self._unsubscribe(node)
+        self._handler.take_pending()
+
+    def resubscribe(self):
+        """
+        monitor channels again after a new session was activated,
+        subscriptions of the previous session are gone
+        """
+        if not use_graph:
+            return
+        self.clear()
+        if self._replay_nodes or not self.subscription_mode:
+            return
+        for node in self._node_list + self._array_nodes:
+            self._subscribe(node)
+
+    def _backfill(self, node):
+        minutes = self.historySpinBox.value()
+        if not minutes or not self.uaclient.client:
+            return
+        self.window.run_async(self._read_history(node, minutes, self._generation, self.N),
+                              callback=lambda count: logger.info("Read %s values of history of %s", count, node),
+                              errback=lambda ex: logger.warning("Could not read history of %s: %s", node, ex))
+
+    async def _read_history(self, node, minutes, generation, limit):
+        # read backwards from now, so reading can stop as soon as the channel is full
+        end = datetime.now(timezone.utc)
+        history = self.uaclient.iter_history_async(node, end, end - timedelta(minutes=minutes), self._history_chunk)
+        count = 0
+        try:
+            async for dvs in history:
+                dvs = dvs[::-1]
+                stamps = np.array([_timestamp(dv) for dv in dvs], dtype=float)
+                values = np.array([_value(dv) for dv in dvs], dtype=float)
+                self._handler.add_history(generation, node.nodeid, stamps, values)
+                count += len(dvs)
+                if count >= limit:
+                    break
+        finally:
+            await history.aclose()
+        return count
+
+    def add_node_to_channel(self, node=None):
         if not isinstance(node, SyncNode):
             node = self.window.get_current_node()
             if node is None:
                 return
-        if node not in self._node_list:
+        if node not in self._node_list and node not in self._array_nodes:
             dtype = node.read_attribute(ua.AttributeIds.DataType)
 
             dtypeStr = ua.ObjectIdNames[dtype.Value.Value.Identifier]
 
-            if dtypeStr in self.acceptedDatatypes and not isinstance(node.get_value(), list):
-                self._node_list.append(node)
+            if dtypeStr in self.acceptedDatatypes and isinstance(node.get_value(), list):
+                self._add_array_channel(node)
+            elif dtypeStr in self.acceptedDatatypes:
                 displayName = node.read_display_name().Text
-                colorIndex = len(self._node_list) % len(self.colorCycle)
-                self._curves.append \
-                    (self.pw.plot(pen=pg.mkPen(color=self.colorCycle[colorIndex], width=3, style=Qt.SolidLine), name=displayName))
-                # set initial data to zero
-                self._channels.append(np.zeros(self.N))  # init data sequence with zeros
-                # add the new channel data to the new curve
-                self._curves[-1].setData(self._channels[-1])
+                self._add_scalar_channel(node, displayName)
+                self._backfill(node)
+                if self.subscription_mode:
+                    self._subscribe(node)
                 logger.info("Variable %s added to graph", displayName)
 
             else:
-                logger.info("Variable cannot be added to graph because it is of type %s or an array", dtypeStr)
+                logger.info("Variable cannot be added to graph because it is of type %s", dtypeStr)
+
+    def _add_scalar_channel(self, node, displayName):
+        self._node_list.append(node)
+        colorIndex = len(self._node_list) % len(self.colorCycle)
+        self._curves.append \
+            (self.pw.plot(pen=pg.mkPen(color=self.colorCycle[colorIndex], width=3, style=Qt.SolidLine), name=displayName))
+        # new channel starts with the samples received from now on
+        self._channels.append(RingBuffer(self.N))
+        self._times.append(RingBuffer(self.N))
+        self._decimated.append(MinMaxCache())
+
+    def _remove_scalar_channel(self, node):
+        idx = self._node_list.index(node)
+        self._node_list.pop(idx)
+        self.legend.removeItem(self._curves[idx])
+        self.pw.removeItem(self._curves[idx])
+        self._curves.pop(idx)
+        self._channels.pop(idx)
+        self._times.pop(idx)
+        self._decimated.pop(idx)
+        self._dirty = set(range(len(self._curves)))
 
-    @trycatchslot
-    def _remove_node_from_channel(self, node=None):
+    def _add_array_channel(self, node):
+        displayName = node.read_display_name().Text
+        plot = self.arrayWidget.addPlot(row=len(self._array_nodes), col=0, title=displayName)
+        plot.setLabel("bottom", "Index")
+        image = pg.ImageItem(axisOrder="row-major")
+        image.setColorMap(pg.colormap.get("viridis"))
+        plot.addItem(image)
+        self._array_nodes.append(node)
+        self._array_channels.append(None)  # length of array known with first value
+        self._array_plots.append(plot)
+        self._array_images.append(image)
+        self._array_curves.append([])
+        self._show_array_mode(len(self._array_nodes) - 1)
+        self.arrayWidget.show()
+        if self.subscription_mode:
+            self._subscribe(node)
+        logger.info("Array variable %s added to graph", displayName)
+
+    def _remove_array_channel(self, node):
+        idx = self._array_nodes.index(node)
+        self._unsubscribe(node)
+        self.arrayWidget.removeItem(self._array_plots[idx])
+        for lst in (self._array_nodes, self._array_channels, self._array_plots, self._array_images, self._array_curves):
+            lst.pop(idx)
+        self._array_dirty = set(range(len(self._array_nodes)))
+        if not self._array_nodes:
+            self.arrayWidget.hide()
+
+    def _array_mode_changed(self, mode):
+        self.window.settings.setValue("graph_array_mode", mode)
+        for i in range(len(self._array_nodes)):
+            self._show_array_mode(i)
+            self._array_dirty.add(i)
+        self._schedule_render()
+
+    def _show_array_mode(self, i):
+        plot = self._array_plots[i]
+        waterfall = self.arrayModeComboBox.currentText() == "Waterfall"
+        self._array_images[i].setVisible(waterfall)
+        if waterfall:
+            for curve in self._array_curves[i]:
+                plot.removeItem(curve)
+            self._array_curves[i] = []
+            plot.setLabel("left", "Sample")
+        else:
+            # newest trace is the most opaque
+            color = pg.mkColor(self.colorCycle[i % len(self.colorCycle)])
+            for k in range(self._array_traces - len(self._array_curves[i])):
+                self._array_curves[i].append(plot.plot())
+            for k, curve in enumerate(self._array_curves[i]):
+                color.setAlphaF((k + 1) / len(self._array_curves[i]))
+                curve.setPen(pg.mkPen(color=pg.mkColor(color), width=1))
+            plot.setLabel("left", "Value")
+
+    def remove_node_from_channel(self, node=None):
         if not isinstance(node, SyncNode):
             node = self.window.get_current_node()
             if node is None:
                 return
+        if node in self._array_nodes:
+            self._remove_array_channel(node)
         if node in self._node_list:
-            idx = self._node_list.index(node)
-            self._node_list.pop(idx)
-            displayName = node.read_display_name().Text
-            self.legend.removeItem(displayName)
-            self.pw.removeItem(self._curves[idx])
-            self._curves.pop(idx)
-            self._channels.pop(idx)
+            self._unsubscribe(node)
+            self._remove_scalar_channel(node)
 
     def pushtoGraph(self):
-        # ringbuffer: shift and replace last
-        for i, node in enumerate(self._node_list):
-            self._channels[i] = np.roll(self._channels[i], -1)  # shift elements to the left by one
-            self._channels[i][-1] = float(node.get_value())
-            self._curves[i].setData(self.ts, self._channels[i])
+        if not self._node_list and not self._array_nodes:
+            return
+        if self._polling:
+            # previous poll is not answered yet, never send overlapping requests
+            self.missed_ticks += 1
+            self._stats_label.setText("Missed ticks: {}".format(self.missed_ticks))
+            logger.warning("Graph poll skipped, previous poll still running")
+            return
+        self._polling = True
+        nodes = self._node_list + self._array_nodes
+        stamp = time.time()
+        generation = self._generation
+        self.window.run_async(self.uaclient.read_attributes_async(nodes, [ua.AttributeIds.Value]),
+                              callback=lambda columns: self._poll_done(generation, stamp, nodes, columns[ua.AttributeIds.Value]),
+                              errback=self._poll_failed)
+
+    def _poll_done(self, generation, stamp, nodes, values):
+        self._polling = False
+        if generation != self._generation:
+            return  # answer to a poll sent before restartTimer
+        if self.uaclient.recorder is not None:
+            for node, dv in zip(nodes, values):
+                self.uaclient.recorder.record_value(node.nodeid, dv)
+        samples = [(node.nodeid, stamp, dv.Value.Value if dv.Value is not None else None, dv.StatusCode)
+                   for node, dv in zip(nodes, values)]
+        self._add_samples(samples)
+
+    def _poll_failed(self, ex):
+        self._polling = False
+        logger.warning("Graph poll failed: %s", ex)
+
+    def _flush(self):
+        samples = self._handler.take_pending()
+        if samples:
+            self._add_samples(samples)
+        for generation, nodeid, stamps, values in self._handler.take_history():
+            if generation == self._generation:
+                self._add_history(nodeid, stamps, values)
+
+    def _add_history(self, nodeid, stamps, values):
+        rows = [i for i, node in enumerate(self._node_list) if node.nodeid == nodeid]
+        if not rows:
+            return
+        i = rows[0]
+        times = self._times[i]
+        if len(times):
+            # only samples older than the ones already received
+            older = stamps < times.view()[0]
+            stamps, values = stamps[older], values[older]
+        times.extendleft(stamps)
+        self._channels[i].extendleft(values)
+        self._dirty.add(i)
+        self._schedule_render()
+
+    def _add_samples(self, samples):
+        """
+        append (NodeId, timestamp, value, status) samples to channels and redraw changed curves
+        """
+        rows = {node.nodeid: i for i, node in enumerate(self._node_list)}
+        array_rows = {node.nodeid: i for i, node in enumerate(self._array_nodes)}
+        changed = set()
+        for nodeid, stamp, val, status in samples:
+            if nodeid in array_rows:
+                self._add_array_value(array_rows[nodeid], val, status)
+                continue
+            i = rows.get(nodeid)
+            if i is None:
+                continue  # removed in between
+            if val is None or status is not None and not status.is_good():
+                val = np.nan
+            self._times[i].append(stamp)
+            self._channels[i].append(float(val))
+            changed.add(i)
+        self._dirty.update(changed)
+        if changed:
+            self._schedule_render()
+
+    def _add_array_value(self, i, val, status):
+        if val is None or status is not None and not status.is_good():
+            return
+        row = np.asarray(val, dtype=float).ravel()
+        channel = self._array_channels[i]
+        if channel is None or channel.sample_shape != row.shape:
+            if channel is not None:
+                logger.warning("Length of %s changed to %s, clearing its plot", self._array_nodes[i], len(row))
+            channel = self._array_channels[i] = RingBuffer(self._array_rows, shape=(len(row),))
+        channel.append(row)
+        self._array_dirty.add(i)
+        self._schedule_render()
+
+    def _schedule_render(self):
+        if not self._render_timer.isActive():
+            self._render_timer.start()
+
+    def _view_changed(self, *args):
+        # when following the data, range changes come from new samples
+        if self.pw.getViewBox().autoRangeEnabled()[0]:
+            return
+        self._dirty.update(range(len(self._curves)))
+        self._schedule_render()
+
+    def _render(self):
+        vb = self.pw.getViewBox()
+        bins = max(int(vb.width()), 100)
+        follow = vb.autoRangeEnabled()[0]
+        x_min, x_max = vb.viewRange()[0]
+        for i in self._dirty:
+            if i >= len(self._curves):
+                continue
+            channel = self._channels[i]
+            x = self._times[i].view()
+            y = channel.view()
+            if follow:
+                # whole channel is visible
+                x, y = self._decimated[i].decimate(x, y, channel.total - len(channel), bins)
+            else:
+                part = visible_slice(x, x_min, x_max)
+                x, y = minmax_decimate(x[part], y[part], bins)
+            # decimation returns views of the buffers when there are few samples,
+            # pyqtgraph keeps the arrays and would see them overwritten by appends
+            self._curves[i].setData(np.array(x), np.array(y), connect="finite")
+        self._dirty.clear()
+        for i in self._array_dirty:
+            if i < len(self._array_nodes):
+                self._render_array(i)
+        self._array_dirty.clear()
+
+    def _render_array(self, i):
+        channel = self._array_channels[i]
+        rows = channel.view() if channel is not None else np.zeros((0, 0))
+        if self.arrayModeComboBox.currentText() == "Waterfall":
+            if len(rows):
+                self._array_images[i].setImage(np.array(rows), autoLevels=True)
+            else:
+                self._array_images[i].clear()
+            return
+        curves = self._array_curves[i]
+        traces = rows[len(rows) - min(len(rows), len(curves)):]
+        for k, curve in enumerate(curves):
+            # newest trace goes to last curve
+            trace = k - (len(curves) - len(traces))
+            if trace < 0:
+                curve.setData([], [])
+            else:
+                curve.setData(np.array(traces[trace]))
 
     def clear(self):
-        pass
+        if not use_graph:
+            return
+        # answer of a running poll is dropped on disconnect, subscriptions are gone with the session
+        self._polling = False
+        self._subscribed_nodes = []
+        self._handler.take_pending()
 
     def show_error(self, *args):
         self.window.show_error(*args)
+
+
+def _timestamp(dv):
+    stamp = dv.SourceTimestamp or dv.ServerTimestamp
+    return stamp.timestamp() if stamp else np.nan
+
+
+def _value(dv):
+    if dv.Value is None or dv.Value.Value is None or dv.StatusCode is not None and not dv.StatusCode.is_good():
+        return np.nan
+    return float(dv.Value.Value)
@@ -1,29 +1,38 @@
 #! /usr/bin/env python3
 
+import asyncio
+import math
+import os
 import sys
+import time
+from datetime import datetime, timezone
+import threading
 
-from datetime import datetime
 import logging
 
 from PyQt5.QtCore import pyqtSignal, QFile, QTimer, Qt, QObject, QSettings, QTextStream, QItemSelection, \
     QCoreApplication
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QIcon
-from PyQt5.QtWidgets import QMainWindow, QMessageBox, QWidget, QApplication, QMenu, QDialog
-
-from uaclient.theme import breeze_resources
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QMainWindow, QMessageBox, QWidget, QApplication, QMenu, QDialog, QLabel, QAction, \
+    QAbstractItemView, QComboBox, QHBoxLayout, QFileDialog, QToolBar, QSlider
 
 from asyncua import ua
 from asyncua.sync import SyncNode
 
 from uaclient.uaclient import UaClient
+from uaclient.timing import timer
+from uaclient.async_bridge import AsyncBridge
+from uaclient.datachange_model import DataChangeModel
+from uaclient.event_model import EventModel
 from uaclient.mainwindow_ui import Ui_MainWindow
 from uaclient.connection_dialog import ConnectionDialog
 from uaclient.application_certificate_dialog import ApplicationCertificateDialog
-from uaclient.graphwidget import GraphUI
+from uaclient.subscription_dialog import SubscriptionDialog
+from uaclient.event_filter_dialog import EventFilterDialog
 
 from uawidgets import resources  # must be here for ressources even if not used
 from uawidgets.attrs_widget import AttrsWidget
-from uawidgets.tree_widget import TreeWidget
+from uawidgets.tree_widget import TreeWidget, TreeViewModel
 from uawidgets.refs_widget import RefsWidget
 from uawidgets.utils import trycatchslot
 from uawidgets.logger import QtHandler
@@ -33,24 +42,69 @@ from uawidgets.call_method_dialog import CallMethodDialog
 logger = logging.getLogger(__name__)
 
 
+class BrowseTreeModel(TreeViewModel):
+    """
+    tree model getting children from fetch_children(parent item) instead of
+    browsing the node itself, so the window can use browse cache and prefetching
+    """
+
+    def __init__(self, fetch_children):
+        TreeViewModel.__init__(self)
+        self._fetch_children = fetch_children
+
+    def fetchMore(self, idx):
+        parent = self.itemFromIndex(idx)
+        if parent:
+            self._fetch_children(parent)
+
+
 class DataChangeHandler(QObject):
-    data_change_fired = pyqtSignal(object, str, str)
+    """
+    Collect data change notifications arriving from client loop.
+    Only latest value of each node is kept until GUI takes them
+    """
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.received = 0
+        self.coalesced = 0
 
     def datachange_notification(self, node, val, data):
-        if data.monitored_item.Value.SourceTimestamp:
-            dato = data.monitored_item.Value.SourceTimestamp.isoformat()
-        elif data.monitored_item.Value.ServerTimestamp:
-            dato = data.monitored_item.Value.ServerTimestamp.isoformat()
-        else:
-            dato = datetime.now().isoformat()
-        self.data_change_fired.emit(node, str(val), dato)
+        with self._lock:
+            self.received += 1
+            if node.nodeid in self._pending:
+                self.coalesced += 1
+            self._pending[node.nodeid] = (node, val, data)
+
+    def take_pending(self):
+        """
+        return notifications received since last call, as a dict NodeId -> (node, val, data)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
 
 
 class EventHandler(QObject):
-    event_fired = pyqtSignal(object)
+    """
+    Collect events arriving from client loop until GUI takes them
+    """
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._lock = threading.Lock()
+        self._pending = []
 
     def event_notification(self, event):
-        self.event_fired.emit(event)
+        with self._lock:
+            self._pending.append(event)
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
 
 
 class EventUI(object):
@@ -60,15 +114,40 @@ class EventUI(object):
         self.uaclient = uaclient
         self._handler = EventHandler()
         self._subscribed_nodes = []  # FIXME: not really needed
-        self.model = QStandardItemModel()
+        self.model = EventModel(int(self.window.settings.value("event_log_size", 10000)))
         self.window.ui.evView.setModel(self.model)
+        self.window.ui.evView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.window.ui.evView.verticalHeader().hide()
+        self.window.ui.evView.horizontalHeader().setStretchLastSection(True)
         self.window.ui.actionSubscribeEvent.triggered.connect(self._subscribe)
         self.window.ui.actionUnsubscribeEvents.triggered.connect(self._unsubscribe)
+        self._actionSubscribeWithFilter = QAction("Subscribe to events with filter...", self.window)
+        self._actionSubscribeWithFilter.triggered.connect(self._subscribe_with_filter)
         # context menu
         self.window.addAction(self.window.ui.actionSubscribeEvent)
+        self.window.addAction(self._actionSubscribeWithFilter)
         self.window.addAction(self.window.ui.actionUnsubscribeEvents)
         self.window.addAction(self.window.ui.actionAddToGraph)
-        self._handler.event_fired.connect(self._update_event_model, type=Qt.QueuedConnection)
+
+        # events are appended in batches at most refresh_rate times per second
+        self._flush_timer = QTimer()
+        self._flush_timer.setInterval(int(1000 / float(self.window.settings.value("refresh_rate", 30))))
+        self._flush_timer.timeout.connect(self._update_event_model)
+        self._stats_label = QLabel()
+        self._sourceComboBox = QComboBox()
+        self._typeComboBox = QComboBox()
+        for combo in (self._sourceComboBox, self._typeComboBox):
+            combo.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+            combo.currentIndexChanged.connect(self._filter_changed)
+        self._update_filter_choices()
+        layout = QHBoxLayout()
+        layout.addWidget(QLabel("Source:"))
+        layout.addWidget(self._sourceComboBox)
+        layout.addWidget(QLabel("Type:"))
+        layout.addWidget(self._typeComboBox)
+        layout.addStretch()
+        layout.addWidget(self._stats_label)
+        self.window.ui.gridLayout_5.addLayout(layout, 1, 0)
 
         # accept drops
         self.model.canDropMimeData = self.canDropMimeData
@@ -87,10 +166,32 @@ class EventUI(object):
 
     def clear(self):
         self._subscribed_nodes = []
+        self._flush_timer.stop()
+        self._handler.take_pending()
         self.model.clear()
+        self._update_filter_choices()
+
+    def start_replay(self):
+        """
+        clear event log and show events of a recording, return handler the player sends them to
+        """
+        self.clear()
+        self._flush_timer.start()
+        return self._handler
 
     @trycatchslot
-    def _subscribe(self, node=None):
+    def _subscribe_with_filter(self):
+        node = self.window.get_current_node()
+        if node is None:
+            return
+        dia = EventFilterDialog(self.window, self.uaclient.event_filter_parameters, node)
+        if dia.exec_() == QDialog.Accepted:
+            self.uaclient.event_filter_parameters = dia.params
+            self.uaclient.save_subscription_settings()
+            self._subscribe(node, dia.params)
+
+    @trycatchslot
+    def _subscribe(self, node=None, filter_params=None):
         logger.info("Subscribing to %s", node)
         if not node:
             node = self.window.get_current_node()
@@ -101,13 +202,15 @@ class EventUI(object):
             return
         logger.info("Subscribing to events for %s", node)
         self.window.ui.evDockWidget.raise_()
-        try:
-            self.uaclient.subscribe_events(node, self._handler)
-        except Exception as ex:
-            self.window.show_error(ex)
-            raise
-        else:
-            self._subscribed_nodes.append(node)
+        self._subscribed_nodes.append(node)
+        self._flush_timer.start()
+        self.window.run_async(self.uaclient.subscribe_events_async(node, self._handler, filter_params),
+                              errback=lambda ex: self._subscribe_failed(node, ex))
+
+    def _subscribe_failed(self, node, ex):
+        if node in self._subscribed_nodes:
+            self._subscribed_nodes.remove(node)
+        self.window.show_error(ex)
 
     @trycatchslot
     def _unsubscribe(self):
@@ -115,11 +218,35 @@ class EventUI(object):
         if node is None:
             return
         self._subscribed_nodes.remove(node)
-        self.uaclient.unsubscribe_events(node)
-
-    @trycatchslot
-    def _update_event_model(self, event):
-        self.model.appendRow([QStandardItem(str(event))])
+        self.window.run_async(self.uaclient.unsubscribe_events_async(node))
+
+    def _update_filter_choices(self):
+        for combo, keys in ((self._sourceComboBox, self.model.sources), (self._typeComboBox, self.model.event_types)):
+            keys = sorted(keys, key=str)
+            current = combo.currentData()
+            if [combo.itemData(i) for i in range(1, combo.count())] == keys:
+                continue
+            combo.blockSignals(True)
+            combo.clear()
+            combo.addItem("All", None)
+            for key in keys:
+                combo.addItem(key.to_string() if isinstance(key, ua.NodeId) else str(key), key)
+            if current in keys:
+                combo.setCurrentIndex(keys.index(current) + 1)
+            combo.blockSignals(False)
+            if combo.currentData() != current:
+                self._filter_changed()
+
+    def _filter_changed(self):
+        self.model.set_filter(self._sourceComboBox.currentData(), self._typeComboBox.currentData())
+
+    def _update_event_model(self):
+        events = self._handler.take_pending()
+        if events:
+            self.model.append_events(events)
+            self._update_filter_choices()
+            self._stats_label.setText("Events: {} of {}, evicted: {}".format(
+                self.model.rowCount(), self.model.capacity, self.model.evicted))
 
 
 class DataChangeUI(object):
@@ -128,20 +255,30 @@ class DataChangeUI(object):
         self.window = window
         self.uaclient = uaclient
         self._subhandler = DataChangeHandler()
-        self._subscribed_nodes = []
-        self.model = QStandardItemModel()
+        self.model = DataChangeModel()
         self.window.ui.subView.setModel(self.model)
         self.window.ui.subView.horizontalHeader().setSectionResizeMode(1)
 
         self.window.ui.actionSubscribeDataChange.triggered.connect(self._subscribe)
         self.window.ui.actionUnsubscribeDataChange.triggered.connect(self._unsubscribe)
+        self._actionSubscribeWithParameters = QAction("Subscribe to data change with parameters...", self.window)
+        self._actionSubscribeWithParameters.triggered.connect(self._subscribe_with_parameters)
+        self._actionSubscribeSubtree = QAction("Subscribe to data change of all variables below selection", self.window)
+        self._actionSubscribeSubtree.triggered.connect(self._subscribe_subtree)
+        self._subtree_limit = int(self.window.settings.value("subtree_subscription_limit", 10000))
 
         # populate contextual menu
         self.window.addAction(self.window.ui.actionSubscribeDataChange)
+        self.window.addAction(self._actionSubscribeWithParameters)
+        self.window.addAction(self._actionSubscribeSubtree)
         self.window.addAction(self.window.ui.actionUnsubscribeDataChange)
 
-        # handle subscriptions
-        self._subhandler.data_change_fired.connect(self._update_subscription_model, type=Qt.QueuedConnection)
+        # notifications are applied in batches at most refresh_rate times per second
+        self._flush_timer = QTimer()
+        self._flush_timer.setInterval(int(1000 / float(self.window.settings.value("refresh_rate", 30))))
+        self._flush_timer.timeout.connect(self._flush)
+        self._stats_label = QLabel()
+        self.window.ui.gridLayout_3.addWidget(self._stats_label, 1, 0)
 
         # accept drops
         self.model.canDropMimeData = self.canDropMimeData
@@ -156,64 +293,225 @@ class DataChangeUI(object):
         return True
 
     def clear(self):
-        self._subscribed_nodes = []
+        self._flush_timer.stop()
+        self._subhandler.take_pending()
         self.model.clear()
 
+    def start_replay(self, nodes):
+        """
+        show nodes of a recording, return handler the player sends their values to
+        """
+        self.clear()
+        self.model.add_nodes(nodes)
+        self._flush_timer.start()
+        return self._subhandler
+
     def show_error(self, *args):
         self.window.show_error(*args)
 
     @trycatchslot
-    def _subscribe(self, node=None):
+    def _subscribe_with_parameters(self):
+        node = self.window.get_current_node()
+        if node is None:
+            return
+        dia = SubscriptionDialog(self.window, self.uaclient.subscription_parameters)
+        if dia.exec_() == QDialog.Accepted:
+            self._subscribe(node, dia.params)
+
+    @trycatchslot
+    def _subscribe(self, node=None, params=None):
         if not isinstance(node, SyncNode):
             node = self.window.get_current_node()
             if node is None:
                 return
-        if node in self._subscribed_nodes:
+        if node.nodeid in self.model:
             logger.warning("allready subscribed to node: %s ", node)
             return
-        self.model.setHorizontalHeaderLabels(["DisplayName", "Value", "Timestamp"])
-        text = str(node.read_display_name().Text)
-        row = [QStandardItem(text), QStandardItem("No Data yet"), QStandardItem("")]
-        row[0].setData(node)
-        self.model.appendRow(row)
-        self._subscribed_nodes.append(node)
+        # display name is filled in when the subscription is done
+        self.model.add_nodes([node])
+        self._flush_timer.start()
         self.window.ui.subDockWidget.raise_()
-        try:
-            self.uaclient.subscribe_datachange(node, self._subhandler)
-        except Exception as ex:
-            self.window.show_error(ex)
-            idx = self.model.indexFromItem(row[0])
-            self.model.takeRow(idx.row())
-            raise
+        self.window.run_async(self._subscribe_node(node, params),
+                              callback=lambda dname: self.model.set_name(node.nodeid, str(dname.Text)),
+                              errback=lambda ex: self._subscribe_failed(node, ex))
+
+    async def _subscribe_node(self, node, params):
+        # both requests are sent at once
+        dname, _ = await asyncio.gather(node.aio_obj.read_display_name(),
+                                        self.uaclient.subscribe_datachange_async(node, self._subhandler, params))
+        return dname
+
+    def _subscribe_failed(self, node, ex):
+        self.window.show_error(ex)
+        self.model.remove_node(node.nodeid)
+
+    @trycatchslot
+    def _subscribe_subtree(self):
+        nodes = self.window.get_selected_nodes()
+        if not nodes:
+            return
+        self.window.run_async(self._collect_variables(nodes), callback=self._subscribe_many)
+
+    async def _collect_variables(self, nodes):
+        # selected variables are taken as they are, objects are searched for variables
+        variables = []
+        folders = []
+        columns = await self.uaclient.read_attributes_async(nodes, [ua.AttributeIds.NodeClass, ua.AttributeIds.DisplayName])
+        for node, nodeclass, dname in zip(nodes, columns[ua.AttributeIds.NodeClass], columns[ua.AttributeIds.DisplayName]):
+            if nodeclass.Value is not None and nodeclass.Value.Value == ua.NodeClass.Variable:
+                name = dname.Value.Value.Text if dname.Value is not None and dname.Value.Value is not None else None
+                variables.append((node.nodeid, str(name if name is not None else node.nodeid.to_string())))
+            else:
+                folders.append(node)
+        if folders:
+            descs = await self.uaclient.collect_variables_async(folders, self._subtree_limit)
+            variables.extend((desc.NodeId, desc.DisplayName.Text) for desc in descs)
+        if len(variables) >= self._subtree_limit:
+            logger.warning("Subscribing only to first %s variables", self._subtree_limit)
+        return variables[:self._subtree_limit]
+
+    def _subscribe_many(self, variables):
+        variables = [(nodeid, name) for nodeid, name in variables if nodeid not in self.model]
+        if not variables:
+            return
+        nodes = [self.uaclient.client.get_node(nodeid) for nodeid, _ in variables]
+        self.model.add_nodes(nodes, [name for _, name in variables])
+        self._flush_timer.start()
+        self.window.ui.subDockWidget.raise_()
+        self.window.run_async(self.uaclient.subscribe_datachange_many_async(nodes, self._subhandler),
+                              callback=lambda handles: self._subscribe_many_done(nodes, handles),
+                              errback=lambda ex: self._subscribe_many_failed(nodes, ex))
+
+    def _subscribe_many_done(self, nodes, handles):
+        failed = [(node, handle) for node, handle in zip(nodes, handles) if isinstance(handle, ua.StatusCode)]
+        for node, status in failed:
+            logger.warning("Could not subscribe to %s: %s", node, status)
+        self.model.remove_nodes([node.nodeid for node, _ in failed])
+        logger.info("Subscribed to %s nodes", len(nodes) - len(failed))
+
+    def _subscribe_many_failed(self, nodes, ex):
+        self.window.show_error(ex)
+        self.model.remove_nodes([node.nodeid for node in nodes])
 
     @trycatchslot
     def _unsubscribe(self):
         node = self.window.get_current_node()
         if node is None:
             return
-        self.uaclient.unsubscribe_datachange(node)
-        self._subscribed_nodes.remove(node)
-        i = 0
-        while self.model.item(i):
-            item = self.model.item(i)
-            if item.data() == node:
-                self.model.removeRow(i)
-            i += 1
-
-    def _update_subscription_model(self, node, value, timestamp):
-        i = 0
-        while self.model.item(i):
-            item = self.model.item(i)
-            if item.data() == node:
-                it = self.model.item(i, 1)
-                it.setText(value)
-                it_ts = self.model.item(i, 2)
-                it_ts.setText(timestamp)
-            i += 1
+        self.window.run_async(self.uaclient.unsubscribe_datachange_async(node, self._subhandler))
+        self.model.remove_node(node.nodeid)
+
+    def _flush(self):
+        pending = self._subhandler.take_pending()
+        if pending:
+            self.model.update(pending)
+            self._stats_label.setText("Queue depth: {}, received: {}, coalesced: {}".format(
+                len(pending), self._subhandler.received, self._subhandler.coalesced))
+
+
+class ReplayUI(object):
+    """
+    Replay a recording into data change, event and graph views, without server
+    """
+
+    speeds = [("1x", 1.0), ("10x", 10.0), ("Max", 0.0)]
+
+    def __init__(self, window):
+        self.window = window
+        self.player = None
+        self._graph_channels = int(self.window.settings.value("replay_graph_channels", 6))
+        self.actionReplay = QAction("Replay Recording...", self.window)
+        self.actionReplay.triggered.connect(self._open)
+        self.window.ui.menuOPC_UA_Client.addAction(self.actionReplay)
+
+        self.toolBar = QToolBar("Replay", self.window)
+        self.toolBar.setObjectName("replayToolBar")
+        self._speedComboBox = QComboBox()
+        for text, speed in self.speeds:
+            self._speedComboBox.addItem(text, speed)
+        self._speedComboBox.currentIndexChanged.connect(self._speed_changed)
+        self.toolBar.addWidget(self._speedComboBox)
+        # slider steps are tenths of a second from start of recording
+        self._slider = QSlider(Qt.Horizontal)
+        self._slider.sliderReleased.connect(self._seek)
+        self.toolBar.addWidget(self._slider)
+        self._position_label = QLabel()
+        self.toolBar.addWidget(self._position_label)
+        self.toolBar.addAction("Stop Replay", self.stop)
+        self.window.addToolBar(Qt.BottomToolBarArea, self.toolBar)
+        self.toolBar.hide()
+        self._timer = QTimer()
+        self._timer.setInterval(200)
+        self._timer.timeout.connect(self._update_position)
+
+    @trycatchslot
+    def _open(self):
+        path = QFileDialog.getExistingDirectory(self.window, "Select recording",
+                                                self.window.settings.value("recording_directory", ""))
+        if path:
+            self.start(path)
+
+    def start(self, path):
+        # numpy is only loaded when recordings are used
+        from uaclient.recorder import Recording
+        from uaclient.replay import Player
+        recording = Recording(path)
+        if recording.start is None:
+            raise ValueError("Recording {} is empty".format(path))
+        self.stop()
+        self.window.disconnect()
+        player = Player(recording, [], [], self._speedComboBox.currentData())
+        numeric = set(recording.numeric_nodes)
+        graph_nodes = [node for node in player.nodes if node.nodeid in numeric][:self._graph_channels]
+        handlers = [self.window.datachange_ui.start_replay(player.nodes), self.window.graph_ui.start_replay(graph_nodes)]
+        player.datachange_handlers = [handler for handler in handlers if handler is not None]
+        player.event_handlers = [self.window.event_ui.start_replay()]
+        self._slider.setRange(0, int(math.ceil((recording.end - recording.start) * 10)))
+        self._slider.setValue(0)
+        self.player = player
+        player.start()
+        self._timer.start()
+        self.toolBar.show()
+        logger.info("Replaying %s nodes of %s", len(player.nodes), path)
+
+    def stop(self):
+        if self.player is None:
+            return
+        self.player.stop()
+        self.player = None
+        self._timer.stop()
+        self.toolBar.hide()
+        self.window.datachange_ui.clear()
+        self.window.event_ui.clear()
+        self.window.graph_ui.stop_replay()
+
+    def _speed_changed(self):
+        if self.player is not None:
+            self.player.speed = self._speedComboBox.currentData()
+
+    def _seek(self):
+        if self.player is None:
+            return
+        # views start over from the new position
+        self.player.seek(self.player.recording.start + self._slider.value() / 10)
+        self.window.graph_ui.reset_channels()
+        self.window.event_ui.start_replay()
+
+    def _update_position(self):
+        player = self.player
+        if not self._slider.isSliderDown():
+            self._slider.setValue(int((player.position - player.recording.start) * 10))
+        text = datetime.fromtimestamp(player.position, timezone.utc).isoformat()
+        if player.finished:
+            text += " (end)"
+        self._position_label.setText(text)
 
 
 class Window(QMainWindow):
 
+    # text, stage, stage count. emitted from client loop while connecting
+    connect_progress = pyqtSignal(str, int, int)
+
     def __init__(self):
         QMainWindow.__init__(self)
         self.ui = Ui_MainWindow()
@@ -228,6 +526,8 @@ class Window(QMainWindow):
         self.tabifyDockWidget(self.ui.evDockWidget, self.ui.subDockWidget)
         self.tabifyDockWidget(self.ui.subDockWidget, self.ui.refDockWidget)
         self.tabifyDockWidget(self.ui.refDockWidget, self.ui.graphDockWidget)
+        # last tabified dock would be shown, graph is only built when needed
+        self.ui.refDockWidget.raise_()
 
         # we only show statusbar in case of errors
         self.ui.statusBar.hide()
@@ -235,9 +535,9 @@ class Window(QMainWindow):
         # setup QSettings for application and get a settings object
         QCoreApplication.setOrganizationName("FreeOpcUa")
         QCoreApplication.setApplicationName("OpcUaClient")
-        self.settings = QSettings()
-
-        self._address_list = self.settings.value("address_list", ["opc.tcp://localhost:4840", "opc.tcp://localhost:53530/OPCUA/SimulationServer/"])
+        with timer.phase("Read settings"):
+            self.settings = QSettings()
+            self._address_list = self.settings.value("address_list", ["opc.tcp://localhost:4840", "opc.tcp://localhost:53530/OPCUA/SimulationServer/"])
         print("ADR", self._address_list)
         self._address_list_max_count = int(self.settings.value("address_list_max_count", 10))
 
@@ -246,9 +546,20 @@ class Window(QMainWindow):
             self.ui.addrComboBox.insertItem(100, addr)
 
         self.uaclient = UaClient()
+        self._timing_steps = set()  # steps of connection not done yet, see _timing_step_done
+        self.async_bridge = AsyncBridge(self)
+        self.connect_progress.connect(self._show_connect_progress)
 
         self.tree_ui = TreeWidget(self.ui.treeView)
         self.tree_ui.error.connect(self.show_error)
+        # browse through uaclient so results are cached, header keeps the state TreeWidget restored
+        self.tree_ui.model = BrowseTreeModel(self._fetch_tree_children)
+        self.tree_ui.model.error.connect(self.tree_ui.error)
+        self.tree_ui.model.setHorizontalHeaderLabels(['DisplayName', "BrowseName", 'NodeId'])
+        header_state = self.ui.treeView.header().saveState()
+        self.ui.treeView.setModel(self.tree_ui.model)
+        self.ui.treeView.header().restoreState(header_state)
+        self.ui.treeView.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setup_context_menu_tree()
         self.ui.treeView.selectionModel().currentChanged.connect(self._update_actions_state)
 
@@ -258,7 +569,14 @@ class Window(QMainWindow):
         self.attrs_ui.error.connect(self.show_error)
         self.datachange_ui = DataChangeUI(self, self.uaclient)
         self.event_ui = EventUI(self, self.uaclient)
-        self.graph_ui = GraphUI(self, self.uaclient)
+        # graph needs pyqtgraph and numpy, it is created when its dock is first shown or used
+        self._graph_ui = None
+        self.ui.graphDockWidget.visibilityChanged.connect(self._graph_dock_visibility_changed)
+        self.ui.actionAddToGraph.triggered.connect(self._add_to_graph)
+        self.ui.actionRemoveFromGraph.triggered.connect(self._remove_from_graph)
+        self.ui.treeView.addAction(self.ui.actionAddToGraph)
+        self.ui.treeView.addAction(self.ui.actionRemoveFromGraph)
+        self.replay_ui = ReplayUI(self)
 
         self.ui.addrComboBox.currentTextChanged.connect(self._uri_changed)
         self._uri_changed(self.ui.addrComboBox.currentText())  # force update for current value at startup
@@ -271,10 +589,11 @@ class Window(QMainWindow):
         self.ui.treeView.selectionModel().selectionChanged.connect(self.show_attrs)
         self.ui.attrRefreshButton.clicked.connect(self.show_attrs)
 
-        self.resize(int(self.settings.value("main_window_width", 800)), int(self.settings.value("main_window_height", 600)))
-        data = self.settings.value("main_window_state", None)
-        if data:
-            self.restoreState(data)
+        with timer.phase("Restore window state"):
+            self.resize(int(self.settings.value("main_window_width", 800)), int(self.settings.value("main_window_height", 600)))
+            data = self.settings.value("main_window_state", None)
+            if data:
+                self.restoreState(data)
 
         self.ui.connectButton.clicked.connect(self.connect)
         self.ui.disconnectButton.clicked.connect(self.disconnect)
@@ -285,8 +604,48 @@ class Window(QMainWindow):
 
         self.ui.connectOptionButton.clicked.connect(self.show_connection_dialog)
         self.ui.actionClient_Application_Certificate.triggered.connect(self.show_application_certificate_dialog)
+        self.actionSubscriptionParameters = QAction("Subscription Parameters", self)
+        self.actionSubscriptionParameters.triggered.connect(self.show_subscription_dialog)
+        self.ui.menuSettings.addAction(self.actionSubscriptionParameters)
+        self.actionRecord = QAction("Record Notifications...", self)
+        self.actionRecord.setCheckable(True)
+        self.actionRecord.setToolTip("Write all data change notifications, events and graph polls to disk")
+        self.actionRecord.triggered.connect(self.toggle_recording)
+        self.ui.menuOPC_UA_Client.addAction(self.actionRecord)
+        self.actionReloadTypes = QAction("Reload Types", self)
+        self.actionReloadTypes.setToolTip("Read custom data types from server again instead of type cache")
+        self.actionReloadTypes.triggered.connect(self.reload_types)
+        self.ui.menuOPC_UA_Client.addAction(self.actionReloadTypes)
+        # shows values dropped by recorder while recording
+        self._record_timer = QTimer()
+        self._record_timer.setInterval(1000)
+        self._record_timer.timeout.connect(self._show_recording_state)
+        self._record_dropped = 0
         self.ui.actionDark_Mode.triggered.connect(self.dark_mode)
 
+    @property
+    def graph_ui(self):
+        self._create_graph_ui()
+        return self._graph_ui
+
+    def _create_graph_ui(self):
+        if self._graph_ui is None:
+            from uaclient.graphwidget import GraphUI
+            self._graph_ui = GraphUI(self, self.uaclient)
+
+    def _graph_dock_visibility_changed(self, visible):
+        if visible and self._graph_ui is None:
+            # window is painted first when graph dock is shown at startup
+            QTimer.singleShot(0, self._create_graph_ui)
+
+    @trycatchslot
+    def _add_to_graph(self):
+        self.graph_ui.add_node_to_channel()
+
+    @trycatchslot
+    def _remove_from_graph(self):
+        self.graph_ui.remove_node_from_channel()
+
     def _uri_changed(self, uri):
         self.uaclient.load_security_settings(uri)
 
@@ -313,6 +672,53 @@ class Window(QMainWindow):
             self.uaclient.application_private_key_path = dia.private_key_path
         self.uaclient.save_application_certificate_settings()
             
+    def show_subscription_dialog(self):
+        dia = SubscriptionDialog(self, self.uaclient.subscription_parameters, self.uaclient.event_publishing_interval)
+        if dia.exec_() == QDialog.Accepted:
+            self.uaclient.subscription_parameters = dia.params
+            self.uaclient.event_publishing_interval = dia.event_publishing_interval
+            self.uaclient.save_subscription_settings()
+
+    @trycatchslot
+    def toggle_recording(self, checked):
+        if not checked:
+            self.stop_recording()
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Select directory for recordings",
+                                                     self.settings.value("recording_directory", ""))
+        if not directory:
+            self.actionRecord.setChecked(False)
+            return
+        self.settings.setValue("recording_directory", directory)
+        from uaclient.recorder import Recorder
+        path = os.path.join(directory, time.strftime("recording-%Y%m%d-%H%M%S"))
+        recorder = Recorder(path, int(self.settings.value("recording_segment_rows", 100000)))
+        recorder.start()
+        self.uaclient.recorder = recorder
+        self._record_dropped = 0
+        self._record_timer.start()
+        logger.info("Recording notifications to %s", path)
+
+    def _show_recording_state(self):
+        recorder = self.uaclient.recorder
+        if recorder is None or recorder.dropped == self._record_dropped:
+            return
+        self._record_dropped = recorder.dropped
+        self.actionRecord.setText("Record Notifications... ({} values dropped)".format(recorder.dropped))
+        self.show_error("Disk is too slow for recording, {} values dropped".format(recorder.dropped))
+
+    def stop_recording(self):
+        recorder = self.uaclient.recorder
+        if recorder is None:
+            return
+        self.uaclient.recorder = None
+        self._record_timer.stop()
+        recorder.stop()
+        self.actionRecord.setChecked(False)
+        self.actionRecord.setText("Record Notifications...")
+        logger.info("Recorded %s values in %s segments to %s, %s values dropped",
+                    recorder.rows, recorder.segments, recorder.path, recorder.dropped)
+
     @trycatchslot
     def show_refs(self, selection):
         if isinstance(selection, QItemSelection):
@@ -340,26 +746,111 @@ class Window(QMainWindow):
         self.ui.statusBar.showMessage(str(msg))
         QTimer.singleShot(1500, self.ui.statusBar.hide)
 
+    def _show_connect_progress(self, text, stage, count):
+        self.ui.statusBar.show()
+        self.ui.statusBar.setStyleSheet("")
+        self.ui.statusBar.showMessage("{} ({}/{})".format(text, stage, count))
+        if stage == count:
+            QTimer.singleShot(1500, self.ui.statusBar.hide)
+
     def get_current_node(self, idx=None):
         return self.tree_ui.get_current_node(idx)
 
+    def get_selected_nodes(self):
+        return [self.tree_ui.get_current_node(idx) for idx in self.ui.treeView.selectionModel().selectedRows(0)]
+
     def get_uaclient(self):
         return self.uaclient
 
+    def run_async(self, coro, callback=None, errback=None):
+        """
+        send request(s) to server without blocking the GUI.
+        callback is called in GUI thread with the result,
+        errors are shown in status bar if no errback is given
+        """
+        if errback is None:
+            errback = self.show_error
+        future = self.uaclient.submit(coro)
+        return self.async_bridge.watch(future, callback, errback)
+
     @trycatchslot
     def connect(self):
         uri = self.ui.addrComboBox.currentText()
         uri = uri.strip()
-        try:
-            self.uaclient.connect(uri)
-        except Exception as ex:
-            self.show_error(ex)
-            raise
-
+        self.replay_ui.stop()
+        self.uaclient.disconnect()
+        # connect in background, tree is shown as soon as session is active
+        # and custom types are loaded afterwards
+        start = time.perf_counter()
+        self.run_async(self.uaclient.connect_async(uri, self.connect_progress.emit),
+                       callback=lambda _: self._session_activated(uri, start))
+
+    def _session_activated(self, uri, start):
+        timer.add("Connect", start)
+        # timing is reported when tree was browsed and types are loaded
+        self._timing_steps = {"browse", "types"}
+        self.uaclient.save_security_settings(uri)
         self._update_address_list(uri)
         self.tree_ui.set_root_node(self.uaclient.client.nodes.root)
         self.ui.treeView.setFocus()
         self.load_current_node()
+        if self._graph_ui is not None:
+            self._graph_ui.resubscribe()
+        start = time.perf_counter()
+        self.run_async(self.uaclient.load_types_async(self.connect_progress.emit),
+                       callback=lambda _: self._timing_step_done("types", "Load types", start))
+
+    @trycatchslot
+    def reload_types(self):
+        if self.uaclient.client is None:
+            self.show_error("Not connected")
+            return
+        self.run_async(self.uaclient.reload_types_async(self.connect_progress.emit))
+
+    def _timing_step_done(self, step, phase, start):
+        if step not in self._timing_steps:
+            return
+        timer.add(phase, start)
+        self._timing_steps.remove(step)
+        if not self._timing_steps:
+            timer.mark("Tree browsable and types loaded")
+            timer.report()
+
+    def _fetch_tree_children(self, parent):
+        model = self.tree_ui.model
+        start = time.perf_counter()
+        try:
+            node = parent.data(Qt.UserRole)
+            added = set()
+            for desc in self.uaclient.get_children(node):
+                if desc.NodeId not in added:
+                    model.add_item(desc, parent)
+                    added.add(desc.NodeId)
+        except Exception as ex:
+            model.error.emit(ex)
+            raise
+        self._timing_step_done("browse", "First browse", start)
+        if self.uaclient.prefetch_children and added:
+            # browse next level of the now visible nodes in one request,
+            # expanding them is then served from the browse cache
+            self.run_async(self.uaclient.browse_many_async(list(added)), errback=logger.warning)
+
+    @trycatchslot
+    def refresh_current_node(self):
+        idx = self.ui.treeView.currentIndex()
+        idx = idx.sibling(idx.row(), 0)
+        item = self.tree_ui.model.itemFromIndex(idx)
+        if item is None or self.uaclient.client is None:
+            return
+        # children were prefetched, their results are as old as those of node
+        nodeids = [item.data(Qt.UserRole).nodeid]
+        nodeids.extend(item.child(row, 0).data(Qt.UserRole).nodeid for row in range(item.rowCount()))
+        self.uaclient.run(self.uaclient.invalidate_browse_cache_async(nodeids))
+        expanded = self.ui.treeView.isExpanded(idx)
+        self.tree_ui.reload(item)
+        # otherwise children are fetched when node is expanded
+        if expanded and self.tree_ui.model.canFetchMore(idx):
+            self.tree_ui.model.fetchMore(idx)
 
     def _update_address_list(self, uri):
         if uri == self._address_list[0]:
@@ -371,6 +862,7 @@ class Window(QMainWindow):
             self._address_list.pop(-1)
 
     def disconnect(self):
+        self.async_bridge.cancel_all()
         try:
             self.uaclient.disconnect()
         except Exception as ex:
@@ -383,9 +875,12 @@ class Window(QMainWindow):
             self.attrs_ui.clear()
             self.datachange_ui.clear()
             self.event_ui.clear()
+            if self._graph_ui is not None:
+                self._graph_ui.clear()
 
 
     def closeEvent(self, event):
+        self.replay_ui.stop()
         self.tree_ui.save_state()
         self.attrs_ui.save_state()
         self.refs_ui.save_state()
@@ -394,6 +889,7 @@ class Window(QMainWindow):
         self.settings.setValue("main_window_state", self.saveState())
         self.settings.setValue("address_list", self._address_list)
         self.disconnect()
+        self.stop_recording()
         event.accept()
 
     def save_current_node(self):
@@ -425,6 +921,13 @@ class Window(QMainWindow):
         self._contextMenu.addSeparator()
         self._contextMenu.addAction(self.ui.actionCall)
         self._contextMenu.addSeparator()
+        self.actionRefreshNode = QAction("Refresh Children", self)
+        self.actionRefreshNode.setToolTip("Browse children of node again instead of taking them from browse cache")
+        self.actionRefreshNode.setShortcut("F5")
+        self.actionRefreshNode.setShortcutContext(Qt.WidgetShortcut)
+        self.actionRefreshNode.triggered.connect(self.refresh_current_node)
+        self.ui.treeView.addAction(self.actionRefreshNode)
+        self.addAction(self.actionRefreshNode)
 
     def addAction(self, action):
         self._contextMenu.addAction(action)
@@ -434,8 +937,13 @@ class Window(QMainWindow):
         node = self.get_current_node(current)
         self.ui.actionCall.setEnabled(False)
         if node:
-            if node.read_node_class() == ua.NodeClass.Method:
-                self.ui.actionCall.setEnabled(True)
+            self.run_async(node.aio_obj.read_node_class(),
+                           callback=lambda nodeclass: self._update_call_action(node, nodeclass))
+
+    def _update_call_action(self, node, nodeclass):
+        # selection may have changed while waiting for server
+        if node == self.get_current_node() and nodeclass == ua.NodeClass.Method:
+            self.ui.actionCall.setEnabled(True)
 
     def _show_context_menu_tree(self, position):
         node = self.tree_ui.get_current_node()
@@ -457,8 +965,10 @@ class Window(QMainWindow):
 
 
 def main():
-    app = QApplication(sys.argv)
-    client = Window()
+    with timer.phase("Create QApplication"):
+        app = QApplication(sys.argv)
+    with timer.phase("Window.__init__"):
+        client = Window()
     handler = QtHandler(client.ui.logTextEdit)
     logging.getLogger().addHandler(handler)
     logging.getLogger("uaclient").setLevel(logging.INFO)
@@ -467,12 +977,15 @@ def main():
 
     # set stylesheet
     if (QSettings().value("dark_mode", "false") == "true"):
+        from uaclient.theme import breeze_resources  # registers :/dark.qss, only needed in dark mode
         file = QFile(":/dark.qss")
         file.open(QFile.ReadOnly | QFile.Text)
         stream = QTextStream(file)
         app.setStyleSheet(stream.readAll())
 
-    client.show()
+    with timer.phase("Show window"):
+        client.show()
+    timer.mark("Window shown")
     sys.exit(app.exec_())
 
 
@@ -209,7 +209,7 @@ class Ui_MainWindow(object):
         self.gridLayout_5.setContentsMargins(11, 11, 11, 11)
         self.gridLayout_5.setSpacing(6)
         self.gridLayout_5.setObjectName("gridLayout_5")
-        self.evView = QtWidgets.QListView(self.dockWidgetContents_5)
+        self.evView = QtWidgets.QTableView(self.dockWidgetContents_5)
         self.evView.setFocusPolicy(QtCore.Qt.StrongFocus)
         self.evView.setAcceptDrops(True)
         self.evView.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
@@ -253,8 +253,8 @@ class Ui_MainWindow(object):
         self.horizontalLayout.addWidget(self.labelNumberOfPoints)
         self.spinBoxNumberOfPoints = QtWidgets.QSpinBox(self.dockWidgetContents_6)
         self.spinBoxNumberOfPoints.setMinimum(10)
-        self.spinBoxNumberOfPoints.setMaximum(100)
-        self.spinBoxNumberOfPoints.setProperty("value", 30)
+        self.spinBoxNumberOfPoints.setMaximum(10000000)
+        self.spinBoxNumberOfPoints.setProperty("value", 3600)
         self.spinBoxNumberOfPoints.setObjectName("spinBoxNumberOfPoints")
         self.horizontalLayout.addWidget(self.spinBoxNumberOfPoints)
         self.labelIntervall = QtWidgets.QLabel(self.dockWidgetContents_6)
@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from asyncua import ua
+from asyncua.common.utils import Buffer
+from asyncua.ua.ua_binary import variant_from_binary, variant_to_binary
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Segment(object):
+    """
+    rows recorded since last segment was written, one list per column
+    """
+
+    def __init__(self):
+        self.node = []
+        self.source = []
+        self.server = []
+        self.status = []
+        self.vtype = []  # VariantType of value, 0 if unknown
+        self.value = []
+        self.objects = {}  # row -> value which is not a number, as Variant if possible
+        self.events = []  # (time, fields)
+
+    def __len__(self):
+        return len(self.node)
+
+
+class Recorder(object):
+    """
+    Write data change notifications and events to a directory of append only
+    segments. A segment is a compressed numpy archive with one column per field:
+    node index, source and server timestamps, status code, VariantType and value.
+    Booleans, floats and integers which a float holds exactly are stored as value,
+    their type is restored from the VariantType column.
+    Values which are not numbers, and fields of events, are stored as JSON,
+    each encoded as OPC UA binary Variant, so recordings can be read without
+    the classes generated for custom structures, or as text if that fails.
+    index.jsonl has one line per segment with its time range and, per node,
+    number of rows, number of numeric values and time range.
+    nodes.json maps node index to NodeId.
+    At most max_pending segments wait for the writer thread, so memory stays
+    bounded. Recording never waits for the disk, when writer is behind full
+    segments are dropped and their rows counted in dropped
+    """
+
+    def __init__(self, path, segment_rows=100000, flush_interval=10.0, max_pending=4):
+        self.path = path
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._segment = _Segment()
+        self._nodes = {}  # NodeId -> index
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._stopping = False
+        self.segments = 0
+        self.rows = 0
+        self.dropped = 0
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name="Recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        write remaining rows and wait for writer thread
+        """
+        self._stopping = True
+        self._queue.put(self._swap())
+        self._queue.put(None)
+        self._thread.join()
+
+    def datachange_notification(self, node, val, data):
+        self.record_value(node.nodeid, data.monitored_item.Value, val)
+
+    def record_value(self, nodeid, dv, val=None):
+        if val is None and dv.Value is not None:
+            val = dv.Value.Value
+        with self._lock:
+            seg = self._segment
+            idx = self._nodes.get(nodeid)
+            if idx is None:
+                idx = self._nodes[nodeid] = len(self._nodes)
+            variant = dv.Value if dv.Value is not None and dv.Value.Value is val else None
+            if variant is not None:
+                seg.vtype.append(variant.VariantType.value)
+            else:
+                seg.vtype.append(_VARIANT_TYPES.get(type(val), 0))
+            if _is_number(val):
+                seg.value.append(float(val))
+            else:
+                seg.value.append(np.nan)
+                if variant is not None:
+                    # keeps VariantType of server
+                    seg.objects[len(seg.node)] = variant
+                elif val is not None:
+                    seg.objects[len(seg.node)] = val
+            seg.node.append(idx)
+            seg.source.append(_epoch(dv.SourceTimestamp))
+            seg.server.append(_epoch(dv.ServerTimestamp))
+            seg.status.append(dv.StatusCode.value if dv.StatusCode is not None else 0)
+            full = len(seg) >= self.segment_rows
+        if full:
+            # called from client loop and GUI thread, which must not wait for the disk
+            seg, nodes = self._swap()
+            try:
+                self._queue.put_nowait((seg, nodes))
+            except queue.Full:
+                self.dropped += len(seg)
+                logger.warning("Recorder of %s is behind, dropped %s values", self.path, len(seg))
+
+    def event_notification(self, event):
+        internal = getattr(event, "internal_properties", ())
+        fields = {name: val for name, val in vars(event).items() if name not in internal}
+        stamp = _epoch(fields.get("Time")) if "Time" in fields else time.time()
+        with self._lock:
+            self._segment.events.append((stamp, fields))
+
+    def _swap(self):
+        with self._lock:
+            seg, self._segment = self._segment, _Segment()
+            nodes = [nodeid.to_string() for nodeid in sorted(self._nodes, key=self._nodes.get)]
+        return seg, nodes
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # write what was received lately even if segment is not full
+                if self._stopping:
+                    continue
+                item = self._swap()
+            if item is None:
+                return
+            seg, nodes = item
+            if not len(seg) and not seg.events:
+                continue
+            try:
+                self._write(seg, nodes)
+            except Exception:
+                logger.exception("Could not write recording segment to %s", self.path)
+
+    def _write(self, seg, nodes):
+        name = "segment-{:06d}.npz".format(self.segments)
+        node = np.array(seg.node, dtype=np.int32)
+        source = np.array(seg.source, dtype=np.float64)
+        value = np.array(seg.value, dtype=np.float64)
+        objects = {str(row): _encode_value(val) for row, val in seg.objects.items()}
+        events = [(stamp, {field: _encode_value(val) for field, val in fields.items()}) for stamp, fields in seg.events]
+        tmp = os.path.join(self.path, name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f,
+                                    node=node,
+                                    source=source,
+                                    server=np.array(seg.server, dtype=np.float64),
+                                    status=np.array(seg.status, dtype=np.uint32),
+                                    vtype=np.array(seg.vtype, dtype=np.uint8),
+                                    value=value,
+                                    objects=_json_array(objects),
+                                    events=_json_array(events))
+            os.replace(tmp, os.path.join(self.path, name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with open(os.path.join(self.path, "nodes.json.tmp"), "w") as f:
+            json.dump(nodes, f)
+        os.replace(os.path.join(self.path, "nodes.json.tmp"), os.path.join(self.path, "nodes.json"))
+        entry = {"segment": name, "rows": len(seg), "events": len(seg.events), "nodes": {}}
+        stamps = np.concatenate([source, np.array([ev[0] for ev in seg.events], dtype=np.float64)])
+        if len(stamps) and not np.isnan(stamps).all():
+            entry["start"], entry["end"] = float(np.nanmin(stamps)), float(np.nanmax(stamps))
+        if len(node):
+            # rows are grouped by node to get count and time range of each node at once
+            order = np.argsort(node, kind="stable")
+            ids, starts, counts = np.unique(node[order], return_index=True, return_counts=True)
+            numeric = np.add.reduceat((~np.isnan(value[order])).astype(np.int64), starts)
+            mins = np.fmin.reduceat(source[order], starts)
+            maxs = np.fmax.reduceat(source[order], starts)
+            for idx, count, numbers, first, last in zip(ids, counts, numeric, mins, maxs):
+                entry["nodes"][str(idx)] = [int(count), int(numbers), _json_float(first), _json_float(last)]
+        with open(os.path.join(self.path, "index.jsonl"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.segments += 1
+        self.rows += len(seg)
+
+
+class Recording(object):
+    """
+    Read a directory written by Recorder
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "nodes.json")) as f:
+            self.nodes = [ua.NodeId.from_string(nodeid) for nodeid in json.load(f)]
+        with open(os.path.join(path, "index.jsonl")) as f:
+            self.index = [json.loads(line) for line in f if line.strip()]
+
+    @property
+    def start(self):
+        starts = [entry["start"] for entry in self.index if "start" in entry]
+        return min(starts) if starts else None
+
+    @property
+    def end(self):
+        ends = [entry["end"] for entry in self.index if "end" in entry]
+        return max(ends) if ends else None
+
+    @property
+    def numeric_nodes(self):
+        """
+        nodes with at least one value which is a number
+        """
+        keys = set(key for entry in self.index for key, counts in entry["nodes"].items() if counts[1])
+        return [nodeid for idx, nodeid in enumerate(self.nodes) if str(idx) in keys]
+
+    def segments(self, nodeid=None, start=None, end=None):
+        """
+        index entries of segments which may contain rows of nodeid between start and end
+        """
+        key = str(self.nodes.index(nodeid)) if nodeid is not None else None
+        for entry in self.index:
+            if key is not None and key not in entry["nodes"]:
+                continue
+            if start is not None and entry.get("end", start) < start:
+                continue
+            if end is not None and entry.get("start", end) > end:
+                continue
+            yield entry
+
+    def read_segment(self, entry):
+        """
+        return columns of a segment as a dict, objects and events are decoded
+        """
+        with np.load(os.path.join(self.path, entry["segment"])) as archive:
+            columns = {name: archive[name] for name in ("node", "source", "server", "status", "vtype", "value")}
+            objects = json.loads(archive["objects"].tobytes().decode("utf-8"))
+            events = json.loads(archive["events"].tobytes().decode("utf-8"))
+        columns["objects"] = {int(row): _decode_value(val) for row, val in objects.items()}
+        columns["events"] = [(stamp, {field: _decode_value(val) for field, val in fields.items()}) for stamp, fields in events]
+        return columns
+
+    def values(self, nodeid, start=None, end=None):
+        """
+        return source timestamps and numeric values of nodeid between start and end
+        """
+        idx = self.nodes.index(nodeid)
+        stamps, values = [], []
+        for entry in self.segments(nodeid, start, end):
+            columns = self.read_segment(entry)
+            mask = columns["node"] == idx
+            if start is not None:
+                mask &= columns["source"] >= start
+            if end is not None:
+                mask &= columns["source"] <= end
+            stamps.append(columns["source"][mask])
+            values.append(columns["value"][mask])
+        if not stamps:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate(stamps), np.concatenate(values)
+
+
+# VariantType of values recorded without their Variant
+_VARIANT_TYPES = {bool: ua.VariantType.Boolean.value, int: ua.VariantType.Int64.value, float: ua.VariantType.Double.value}
+
+
+def _is_number(val):
+    """
+    True if val is stored exactly in the float column, other values are encoded
+    """
+    if type(val) is float or type(val) is bool:
+        return True
+    return type(val) is int and -2 ** 53 <= val <= 2 ** 53
+
+
+def _epoch(stamp):
+    return stamp.timestamp() if stamp is not None else np.nan
+
+
+def _encode_value(val):
+    """
+    encode value as "v:" and hex of binary Variant, or "s:" and text
+    when its type has no encoding, for example a class generated for a structure
+    which is not registered
+    """
+    try:
+        variant = val if isinstance(val, ua.Variant) else ua.Variant(val)
+        return "v:" + variant_to_binary(variant).hex()
+    except Exception:
+        pass
+    try:
+        return "s:" + str(val)
+    except Exception:
+        logger.exception("Could not record value of type %s", type(val))
+        return "s:"
+
+
+def _decode_value(text):
+    """
+    structures whose type is not registered are returned as ExtensionObject
+    """
+    kind, data = text[:2], text[2:]
+    if kind == "v:":
+        try:
+            return variant_from_binary(Buffer(bytes.fromhex(data))).Value
+        except Exception:
+            logger.exception("Could not decode recorded value %s", data)
+    return data
+
+
+def _json_array(obj):
+    return np.frombuffer(json.dumps(obj).encode("utf-8"), dtype=np.uint8)
+
+
+def _json_float(val):
+    return None if np.isnan(val) else float(val)
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from asyncua import ua
+from asyncua.common.events import Event
+from asyncua.common.subscription import DataChangeNotif
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayNode(object):
+    """
+    node of a recording, views only use its nodeid
+    """
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+    def __str__(self):
+        return "ReplayNode({})".format(self.nodeid.to_string())
+
+    __repr__ = __str__
+
+
+class Player(object):
+    """
+    Send rows of a Recording to data change and event handlers, the same way
+    a subscription does, from a thread of its own.
+    speed is a factor of recorded time, 0 sends as fast as possible.
+    At end of recording player waits for a seek or stop
+    """
+
+    def __init__(self, recording, datachange_handlers, event_handlers, speed=1.0):
+        self.recording = recording
+        self.datachange_handlers = datachange_handlers
+        self.event_handlers = event_handlers
+        self.nodes = [ReplayNode(nodeid) for nodeid in recording.nodes]
+        self._speed = speed
+        self._seek = recording.start
+        self._stopping = False
+        self._wake = threading.Event()
+        self._thread = None
+        self.position = recording.start  # recording time of last notification sent
+        self.finished = False
+        self.sent = 0
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="Player", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+
+    def seek(self, stamp):
+        """
+        continue from recording time stamp, in seconds since epoch
+        """
+        self._seek = stamp
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            start, self._seek = self._seek, None
+            if start is None:
+                self.finished = True
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self.finished = False
+            try:
+                self._play(start)
+            except Exception:
+                logger.exception("Replay of %s failed", self.recording.path)
+                self.finished = True
+                return
+
+    def _play(self, start):
+        speed = None
+        anchor = None  # (clock, recording time) notifications are paced from
+        for stamp, notification in self._notifications(start):
+            while True:
+                if self._stopping or self._seek is not None:
+                    return
+                if self._speed != speed:
+                    speed = self._speed
+                    anchor = None
+                if not speed or np.isnan(stamp):
+                    break
+                if anchor is None:
+                    anchor = (time.monotonic(), stamp)
+                delay = (stamp - anchor[1]) / speed - (time.monotonic() - anchor[0])
+                if delay <= 0:
+                    break
+                # woken early by seek, stop or change of speed
+                self._wake.wait(delay)
+                self._wake.clear()
+            if isinstance(notification, Event):
+                for handler in self.event_handlers:
+                    handler.event_notification(notification)
+            else:
+                for handler in self.datachange_handlers:
+                    handler.datachange_notification(*notification)
+            if not np.isnan(stamp):
+                self.position = stamp
+            self.sent += 1
+
+    def _notifications(self, start):
+        """
+        yield (recording time, notification) from start on, a notification is
+        (node, val, data) for a data change or an Event.
+        Rows are sorted by time within a segment
+        """
+        for entry in self.recording.segments(start=start):
+            columns = self.recording.read_segment(entry)
+            source, server = columns["source"], columns["server"]
+            stamps = np.where(np.isnan(source), server, source)
+            rows = np.flatnonzero(stamps >= start)
+            events = [(stamp, fields) for stamp, fields in columns["events"] if stamp >= start]
+            order = np.argsort(np.concatenate([stamps[rows], [stamp for stamp, _ in events]]), kind="stable")
+            for k in order:
+                if k < len(rows):
+                    row = rows[k]
+                    yield stamps[row], self._datachange(columns, row)
+                else:
+                    stamp, fields = events[k - len(rows)]
+                    yield stamp, _event(fields)
+
+    def _datachange(self, columns, row):
+        vtype = int(columns["vtype"][row])
+        val = columns["objects"].get(row)
+        if val is None:
+            val = _number(columns["value"][row], vtype)
+        dv = ua.DataValue(_variant(val, vtype),
+                          StatusCode=ua.StatusCode(int(columns["status"][row])),
+                          SourceTimestamp=_datetime(columns["source"][row]),
+                          ServerTimestamp=_datetime(columns["server"][row]))
+        return self.nodes[columns["node"][row]], val, DataChangeNotif(None, ua.MonitoredItemNotification(Value=dv))
+
+
+def _number(val, vtype):
+    """
+    restore type of a value of the float column
+    """
+    if np.isnan(val):
+        # NaN of a Double, or no value at all
+        return float(val) if vtype in _FLOAT_TYPES else None
+    if vtype == ua.VariantType.Boolean.value:
+        return bool(val)
+    if vtype in _FLOAT_TYPES:
+        return float(val)
+    return int(val)
+
+
+_FLOAT_TYPES = (ua.VariantType.Float.value, ua.VariantType.Double.value)
+
+
+def _variant(val, vtype=0):
+    if vtype and val is not None:
+        try:
+            return ua.Variant(val, ua.VariantType(vtype))
+        except Exception:
+            pass
+    try:
+        return ua.Variant(val)
+    except Exception:
+        return None  # type cannot be guessed, handlers get val anyway
+
+
+def _event(fields):
+    event = Event()
+    for name, val in fields.items():
+        setattr(event, name, val)
+    return event
+
+
+def _datetime(stamp):
+    return None if np.isnan(stamp) else datetime.fromtimestamp(stamp, timezone.utc)
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity buffer of samples with O(1) append.
+    Every sample is written twice, at i and i + capacity, so the samples
+    in chronological order are always a contiguous slice and view()
+    returns a numpy view without copying.
+    total counts appended samples, the one at view()[i] was appended as
+    number total - len(self) + i, so it keeps its number while older ones are dropped
+    """
+
+    def __init__(self, capacity, dtype=float, shape=()):
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity,) + tuple(shape), dtype)
+        self._index = 0  # where next sample is written
+        self._count = 0
+        self.total = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def sample_shape(self):
+        return self._data.shape[1:]
+
+    def append(self, value):
+        self._data[self._index] = value
+        self._data[self._index + self.capacity] = value
+        self._index = (self._index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+        self.total += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        self.total += len(values)
+        values = values[-self.capacity:]
+        if not len(values):
+            return
+        positions = (self._index + np.arange(len(values))) % self.capacity
+        self._data[positions] = values
+        self._data[positions + self.capacity] = values
+        self._index = (self._index + len(values)) % self.capacity
+        self._count = min(self._count + len(values), self.capacity)
+
+    def extendleft(self, values):
+        """
+        put values, in chronological order, before the oldest sample.
+        Only free space is used, return number of values stored
+        """
+        values = np.asarray(values, dtype=self._data.dtype)
+        free = self.capacity - self._count
+        if not free or not len(values):
+            return 0
+        values = values[max(len(values) - free, 0):]
+        oldest = (self._index - self._count) % self.capacity
+        positions = (oldest - len(values) + np.arange(len(values))) % self.capacity
+        self._data[positions] = values
+        self._data[positions + self.capacity] = values
+        self._count += len(values)
+        return len(values)
+
+    def view(self):
+        """
+        samples from oldest to newest, only valid until next append
+        """
+        end = self._index + self.capacity
+        return self._data[end - self._count:end]
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+        self.total = 0
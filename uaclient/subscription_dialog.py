@@ -0,0 +1,79 @@
+from PyQt5.QtWidgets import QDialog, QFormLayout, QDoubleSpinBox, QSpinBox, QCheckBox, QComboBox, QDialogButtonBox
+
+from uaclient.uaclient import SubscriptionParameters
+
+
+class SubscriptionDialog(QDialog):
+    """
+    Edit sampling interval, queue and deadband of monitored items
+    """
+
+    deadband_types = ["None", "Absolute", "Percent"]
+
+    def __init__(self, parent, params, event_publishing_interval=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Subscription Parameters")
+        layout = QFormLayout(self)
+
+        self.samplingSpinBox = QDoubleSpinBox()
+        self.samplingSpinBox.setRange(0, 3600000)
+        self.samplingSpinBox.setSuffix(" ms")
+        self.samplingSpinBox.setToolTip("Nodes with the same sampling interval share one subscription")
+        layout.addRow("Sampling interval", self.samplingSpinBox)
+
+        self.queueSpinBox = QSpinBox()
+        self.queueSpinBox.setRange(0, 100000)
+        layout.addRow("Queue size", self.queueSpinBox)
+
+        self.discardCheckBox = QCheckBox("Discard oldest")
+        layout.addRow("", self.discardCheckBox)
+
+        self.deadbandComboBox = QComboBox()
+        self.deadbandComboBox.addItems(self.deadband_types)
+        layout.addRow("Deadband", self.deadbandComboBox)
+
+        self.deadbandSpinBox = QDoubleSpinBox()
+        self.deadbandSpinBox.setRange(0, 1e12)
+        self.deadbandSpinBox.setDecimals(4)
+        layout.addRow("Deadband value", self.deadbandSpinBox)
+        self.deadbandComboBox.currentIndexChanged.connect(
+            lambda idx: self.deadbandSpinBox.setEnabled(idx != 0))
+
+        self.eventSpinBox = None
+        if event_publishing_interval is not None:
+            self.eventSpinBox = QDoubleSpinBox()
+            self.eventSpinBox.setRange(0, 3600000)
+            self.eventSpinBox.setSuffix(" ms")
+            self.eventSpinBox.setValue(event_publishing_interval)
+            layout.addRow("Event publishing interval", self.eventSpinBox)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+        self.params = params
+
+    @property
+    def params(self):
+        deadband_type = self.deadbandComboBox.currentText()
+        return SubscriptionParameters(self.samplingSpinBox.value(),
+                                      self.queueSpinBox.value(),
+                                      self.discardCheckBox.isChecked(),
+                                      None if deadband_type == "None" else deadband_type,
+                                      self.deadbandSpinBox.value())
+
+    @params.setter
+    def params(self, params):
+        self.samplingSpinBox.setValue(params.sampling_interval)
+        self.queueSpinBox.setValue(params.queue_size)
+        self.discardCheckBox.setChecked(params.discard_oldest)
+        self.deadbandComboBox.setCurrentText(params.deadband_type or "None")
+        self.deadbandSpinBox.setValue(params.deadband_value)
+        self.deadbandSpinBox.setEnabled(bool(params.deadband_type))
+
+    @property
+    def event_publishing_interval(self):
+        if self.eventSpinBox is None:
+            return None
+        return self.eventSpinBox.value()
@@ -0,0 +1,120 @@
+"""
+Durations of startup and connection phases, printed and saved as JSON
+when opcua-client is started with --timing
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+def default_path():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "opcua-client", "timing.json")
+
+
+class PhaseTimer(object):
+    """
+    Named phases with their start, in seconds since the timer was created,
+    and duration. Phases may be added from any thread.
+    Phases are only recorded and reported when path is set,
+    otherwise all methods return at once
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.created = datetime.now(timezone.utc)
+        self.phases = []  # (name, start, duration)
+        self.path = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def add(self, name, start, end=None):
+        """
+        add phase between perf_counter values start and end, end defaults to now
+        """
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, start - self.origin, end - start))
+
+    def mark(self, name):
+        """
+        add phase from creation of timer to now
+        """
+        self.add(name, self.origin)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def timed(self, name, func):
+        """
+        wrap coroutine function func so each call is a phase
+        """
+        if not self.enabled:
+            return func
+
+        async def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+
+    def to_dict(self):
+        with self._lock:
+            phases = list(self.phases)
+        return {"created": self.created.isoformat(),
+                "phases": [{"name": name, "start": round(start, 6), "duration": round(duration, 6)}
+                           for name, start, duration in phases]}
+
+    def format(self):
+        lines = ["{:<40} {:>9} {:>9}".format("Phase", "Start", "Duration")]
+        for phase in self.to_dict()["phases"]:
+            lines.append("{:<40} {:>9.3f} {:>9.3f}".format(phase["name"], phase["start"], phase["duration"]))
+        return "\n".join(lines) + "\n"
+
+    def report(self, out=None):
+        """
+        print phases and save them to path, if enabled
+        """
+        if not self.enabled:
+            return
+        (out or sys.stderr).write(self.format())
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+# created when uaclient.cli is imported, as early as possible
+timer = PhaseTimer()
+
+
+def pop_timing_option(argv):
+    """
+    enable timer if argv has --timing or --timing=FILE, return the other arguments
+    """
+    rest = []
+    for arg in argv:
+        if arg == "--timing":
+            timer.path = default_path()
+        elif arg.startswith("--timing="):
+            timer.path = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return rest
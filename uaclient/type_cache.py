@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from asyncua import ua
+from asyncua.common.utils import Buffer
+from asyncua.ua.ua_binary import struct_from_binary, struct_to_binary
+from asyncua.common.structures104 import RecursiveParser, clean_name, get_children_descriptions_type_definitions, \
+    make_basetype, make_enum, make_structure
+
+
+logger = logging.getLogger(__name__)
+
+# increase when the content of cache files changes
+CACHE_FORMAT = 2
+
+# properties of NamespaceMetadata objects below Server.Namespaces telling the model version
+NAMESPACE_VERSION_PROPERTIES = ("NamespaceUri", "NamespaceVersion", "NamespacePublicationDate")
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "opcua-client", "types")
+
+
+class TypeDefinitions(object):
+    """
+    Definitions of the custom data types of a server,
+    enough to generate the python classes without talking to server
+    """
+
+    def __init__(self):
+        self.aliases = []  # (name, nodeid, parent name), parents first
+        self.enums = []  # (name, nodeid, EnumDefinition, option set)
+        self.structs = []  # (name, nodeid, StructureDefinition)
+
+    async def read(self, client):
+        """
+        read definitions from server
+        """
+        await self._read_aliases(client, client.nodes.base_data_type, None)
+        for base_node, option_set in ((client.nodes.enum_data_type, False), (client.nodes.option_set_type, True)):
+            descs, edefs = await get_children_descriptions_type_definitions(client, base_node, overwrite_existing=True)
+            for desc, edef in zip(descs, edefs):
+                if edef:
+                    self.enums.append((clean_name(desc.BrowseName.Name), desc.NodeId, edef, option_set))
+        dtypes = await RecursiveParser(client).parse(client.nodes.base_structure_type, overwrite_existing=True)
+        self.structs = [(dtype.name, dtype.data_type, dtype.sdef) for dtype in dtypes]
+
+    async def _read_aliases(self, client, node, parent_name):
+        descs = await node.get_children_descriptions(refs=ua.ObjectIds.HasSubtype)
+        children = []
+        for desc in descs:
+            name = clean_name(desc.BrowseName.Name)
+            if parent_name is None:
+                if name in ("Structure", "Enumeration"):
+                    continue
+            elif parent_name != "Number":
+                self.aliases.append((name, desc.NodeId, parent_name))
+            children.append(self._read_aliases(client, client.get_node(desc.NodeId), name))
+        # a parent is always appended before its children
+        await asyncio.gather(*children)
+
+    def to_dict(self):
+        """
+        definitions as something json can encode, DataTypeDefinitions in OPC UA binary encoding
+        """
+        return {"aliases": [[name, nodeid.to_string(), parent_name] for name, nodeid, parent_name in self.aliases],
+                "enums": [[name, nodeid.to_string(), _definition_to_json(edef), option_set]
+                          for name, nodeid, edef, option_set in self.enums],
+                "structs": [[name, nodeid.to_string(), _definition_to_json(sdef)] for name, nodeid, sdef in self.structs]}
+
+    @classmethod
+    def from_dict(cls, data):
+        definitions = cls()
+        definitions.aliases = [(name, ua.NodeId.from_string(nodeid), parent_name)
+                               for name, nodeid, parent_name in data["aliases"]]
+        definitions.enums = [(name, ua.NodeId.from_string(nodeid), _definition_from_json(edef), option_set)
+                             for name, nodeid, edef, option_set in data["enums"]]
+        definitions.structs = [(name, ua.NodeId.from_string(nodeid), _definition_from_json(sdef))
+                               for name, nodeid, sdef in data["structs"]]
+        return definitions
+
+    def register(self, overwrite=False):
+        """
+        generate classes and register them in ua module,
+        types already registered are only generated again if overwrite is set
+        """
+        for name, nodeid, parent_name in self.aliases:
+            if not hasattr(ua, name):
+                ua.register_basetype(name, nodeid, make_basetype(name, parent_name)[name])
+        for name, nodeid, edef, option_set in self.enums:
+            if not overwrite and _is_registered(name, nodeid):
+                continue
+            try:
+                cls = make_enum(name, edef, option_set)[name]
+            except Exception:
+                logger.exception("Failed to generate enum %s", name)
+                continue
+            ua.register_enum(name, nodeid, cls)
+        # structures may depend on each other, retry until nothing more can be resolved
+        todo = [struct for struct in self.structs if overwrite or not _is_registered(struct[0], struct[1])]
+        while todo:
+            failed = []
+            for name, nodeid, sdef in todo:
+                try:
+                    cls = make_structure(nodeid, name, sdef, log_error=False)[name]
+                except Exception:
+                    failed.append((name, nodeid, sdef))
+                    continue
+                cls.data_type = nodeid
+                ua.register_extension_object(name, sdef.DefaultEncodingId, cls, nodeid)
+            if len(failed) == len(todo):
+                logger.warning("Failed to generate structures %s", [struct[0] for struct in failed])
+                break
+            todo = failed
+
+
+def _definition_to_json(definition):
+    if definition is None:
+        return None
+    return [type(definition).__name__, struct_to_binary(definition).hex()]
+
+
+def _definition_from_json(data):
+    if data is None:
+        return None
+    name, binary = data
+    if name not in ("EnumDefinition", "StructureDefinition"):
+        raise ValueError("Unexpected data type definition {}".format(name))
+    return struct_from_binary(getattr(ua, name), Buffer(bytes.fromhex(binary)))
+
+
+def _is_registered(name, nodeid):
+    existing = getattr(ua, name, None)
+    return existing is not None and getattr(existing, "data_type", None) == nodeid
+
+
+def types_changed(event):
+    """
+    True if a GeneralModelChangeEvent may concern data types. AffectedType is
+    only set for objects and variables, events without details may concern anything
+    """
+    changes = getattr(event, "Changes", None)
+    if not changes:
+        return True
+    return any(change.AffectedType is None or change.AffectedType.is_null() for change in changes)
+
+
+class TypeCache(object):
+    """
+    Keep type definitions of servers on disk.
+    Entries are keyed by endpoint uri, NamespaceArray, version and publication
+    date of each namespace and BuildInfo of server, so they get stale when
+    server model changes. Servers without NamespaceMetadata only change the
+    key with their software, so entries are also invalidated on model change
+    events and can be reloaded by user
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = default_cache_dir()
+        self.path = path
+
+    @staticmethod
+    async def fingerprint(client, uri):
+        namespaces = await client.get_namespace_array()
+        try:
+            build_info = await client.get_node(ua.ObjectIds.Server_ServerStatus_BuildInfo).read_value()
+            build = [build_info.ProductUri, build_info.SoftwareVersion, build_info.BuildNumber, str(build_info.BuildDate)]
+        except ua.UaError:
+            build = []
+        try:
+            versions = await _namespace_versions(client)
+        except ua.UaError:
+            versions = []
+        return repr([CACHE_FORMAT, uri, namespaces, versions, build])
+
+    def _file_name(self, uri):
+        return os.path.join(self.path, hashlib.sha1(uri.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, uri, fingerprint):
+        """
+        return cached TypeDefinitions or None if missing or stale
+        """
+        try:
+            with open(self._file_name(uri)) as f:
+                data = json.load(f)
+            if data["fingerprint"] != fingerprint:
+                logger.info("Type cache of %s is stale", uri)
+                return None
+            return TypeDefinitions.from_dict(data["definitions"])
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception("Could not read type cache of %s", uri)
+            return None
+
+    def save(self, uri, fingerprint, definitions):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file_name(uri) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fingerprint": fingerprint, "definitions": definitions.to_dict()}, f)
+        os.replace(tmp, self._file_name(uri))
+
+    def invalidate(self, uri):
+        try:
+            os.remove(self._file_name(uri))
+        except FileNotFoundError:
+            pass
+
+
+async def _namespace_versions(client):
+    """
+    read NamespaceMetadata of all namespaces with three requests,
+    return sorted [uri, version, publication date] of each namespace
+    """
+    descs = await client.get_node(ua.ObjectIds.Server_Namespaces).get_children_descriptions()
+    paths = []
+    for desc in descs:
+        for name in NAMESPACE_VERSION_PROPERTIES:
+            element = ua.RelativePathElement(ReferenceTypeId=ua.NodeId(ua.ObjectIds.HasProperty), IsInverse=False,
+                                             TargetName=ua.QualifiedName(name, 0))
+            path = ua.BrowsePath()
+            path.StartingNode = desc.NodeId
+            path.RelativePath = ua.RelativePath(Elements=[element])
+            paths.append(path)
+    if not paths:
+        return []
+    results = await client.uaclient.translate_browsepaths_to_nodeids(paths)
+    found = [(i, result.Targets[0].TargetId) for i, result in enumerate(results)
+             if result.StatusCode.is_good() and result.Targets]
+    if not found:
+        return []
+    dvs = await client.read_attributes([client.get_node(nodeid) for _, nodeid in found])
+    versions = [[None] * len(NAMESPACE_VERSION_PROPERTIES) for _ in descs]
+    for (i, _), dv in zip(found, dvs):
+        if dv.StatusCode.is_good() and dv.Value is not None:
+            versions[i // len(NAMESPACE_VERSION_PROPERTIES)][i % len(NAMESPACE_VERSION_PROPERTIES)] = str(dv.Value.Value)
+    return sorted(versions, key=repr)
@@ -1,31 +1,272 @@
+import asyncio
 import logging
 
-from PyQt5.QtCore import QSettings
-
 from asyncua import ua
-from asyncua.sync import Client, SyncNode
+from asyncua.sync import Client, SyncNode, ThreadLoop
 from asyncua import crypto
-from asyncua.tools import endpoint_to_strings
+from asyncua.common.events import select_clauses_from_evtype
+from asyncua.common.structures104 import load_custom_struct
+from asyncua.common.utils import Buffer
+
+from uaclient.browse_cache import BrowseCache
+from uaclient.timing import timer
+from uaclient.type_cache import TypeCache, TypeDefinitions, types_changed
 
 
 logger = logging.getLogger(__name__)
 
 
+# stages reported while connecting, see UaClient.connect_async and UaClient.load_types_async
+CONNECT_STAGES = (
+    "Opening session",
+    "Loading data type definitions",
+    "Loading enums",
+    "Loading type definitions",
+    "Custom types loaded",
+)
+
+
+# steps of asyncua.Client.connect, timed when timing is enabled
+CONNECT_STEPS = (
+    ("connect_socket", "Open socket"),
+    ("send_hello", "Send hello"),
+    ("open_secure_channel", "Open secure channel"),
+    ("create_session", "Create session"),
+    ("activate_session", "Activate session"),
+)
+
+
+def _report(progress, stage):
+    if progress is not None:
+        progress(CONNECT_STAGES[stage], stage + 1, len(CONNECT_STAGES))
+
+
+class SubscriptionParameters(object):
+    """
+    Parameters of a monitored item. Items with the same publishing interval,
+    by default their sampling interval, share one subscription publishing at that rate
+    """
+
+    def __init__(self, sampling_interval=500, queue_size=0, discard_oldest=True, deadband_type=None, deadband_value=0.0,
+                 publishing_interval=None):
+        self.sampling_interval = sampling_interval
+        self.queue_size = queue_size
+        self.discard_oldest = discard_oldest
+        self.deadband_type = deadband_type  # None, "Absolute" or "Percent"
+        self.deadband_value = deadband_value
+        self._publishing_interval = publishing_interval
+
+    @property
+    def publishing_interval(self):
+        if self._publishing_interval is None:
+            return self.sampling_interval
+        return self._publishing_interval
+
+    def to_list(self):
+        return [self.sampling_interval, self.queue_size, self.discard_oldest, self.deadband_type, self.deadband_value]
+
+    @classmethod
+    def from_list(cls, values):
+        sampling_interval, queue_size, discard_oldest, deadband_type, deadband_value = values
+        return cls(float(sampling_interval), int(queue_size), discard_oldest in (True, "true"), deadband_type or None, float(deadband_value))
+
+    def make_filter(self):
+        if not self.deadband_type:
+            return None
+        mfilter = ua.DataChangeFilter()
+        mfilter.Trigger = ua.DataChangeTrigger.StatusValue
+        mfilter.DeadbandType = getattr(ua.DeadbandType, self.deadband_type)
+        mfilter.DeadbandValue = self.deadband_value
+        return mfilter
+
+
+class EventFilterParameters(object):
+    """
+    Server side filtering of events. Events must be of one of event_types
+    (or a subtype), have at least min_severity and come from one of
+    source_nodes, empty values do not filter.
+    fields restricts the select clauses, base_fields are always selected
+    """
+
+    base_fields = ["EventType", "SourceName", "Time", "Severity", "Message"]
+
+    def __init__(self, event_types=None, min_severity=0, source_nodes=None, fields=None):
+        self.event_types = event_types or []
+        self.min_severity = min_severity
+        self.source_nodes = source_nodes or []
+        self.fields = fields or []
+
+    def to_list(self):
+        return [[nodeid.to_string() for nodeid in self.event_types],
+                self.min_severity,
+                [nodeid.to_string() for nodeid in self.source_nodes],
+                list(self.fields)]
+
+    @classmethod
+    def from_list(cls, values):
+        event_types, min_severity, source_nodes, fields = values
+        return cls([ua.NodeId.from_string(nodeid) for nodeid in event_types or []],
+                   int(min_severity),
+                   [ua.NodeId.from_string(nodeid) for nodeid in source_nodes or []],
+                   list(fields or []))
+
+    async def make_filter(self, client):
+        evfilter = ua.EventFilter()
+        evtypes = [client.get_node(nodeid) for nodeid in self.event_types or [ua.ObjectIds.BaseEventType]]
+        clauses = await select_clauses_from_evtype(evtypes)
+        if self.fields:
+            wanted = set(self.base_fields + list(self.fields))
+            clauses = [clause for clause in clauses if "/".join(qname.Name for qname in clause.BrowsePath) in wanted]
+        evfilter.SelectClauses = clauses
+        evfilter.WhereClause = _content_filter(self.where_condition())
+        return evfilter
+
+    def where_condition(self):
+        """
+        return condition as nested (FilterOperator, operands) tuples, or None
+        """
+        conditions = []
+        if self.event_types:
+            conditions.append(_combine(ua.FilterOperator.Or, [
+                (ua.FilterOperator.OfType, [ua.LiteralOperand(Value=ua.Variant(nodeid))])
+                for nodeid in self.event_types]))
+        if self.min_severity:
+            conditions.append((ua.FilterOperator.GreaterThanOrEqual, [
+                _event_field("Severity"), ua.LiteralOperand(Value=ua.Variant(self.min_severity, ua.VariantType.UInt16))]))
+        if self.source_nodes:
+            conditions.append((ua.FilterOperator.InList, [_event_field("SourceNode")] + [
+                ua.LiteralOperand(Value=ua.Variant(nodeid)) for nodeid in self.source_nodes]))
+        if not conditions:
+            return None
+        return _combine(ua.FilterOperator.And, conditions)
+
+
+def _event_field(name):
+    op = ua.SimpleAttributeOperand()
+    op.TypeDefinitionId = ua.NodeId(ua.ObjectIds.BaseEventType)
+    op.BrowsePath = [ua.QualifiedName(name, 0)]
+    op.AttributeId = ua.AttributeIds.Value
+    return op
+
+
+def _combine(operator, conditions):
+    # And and Or take two operands
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = (operator, [condition, other])
+    return condition
+
+
+def _content_filter(condition):
+    """
+    flatten nested conditions to ContentFilter elements, first element is the root
+    """
+    cf = ua.ContentFilter()
+
+    def add(cond):
+        operator, operands = cond
+        el = ua.ContentFilterElement()
+        el.FilterOperator = operator
+        index = len(cf.Elements)
+        cf.Elements.append(el)
+        el.FilterOperands = [ua.ElementOperand(Index=add(op)) if isinstance(op, tuple) else op for op in operands]
+        return index
+
+    if condition is not None:
+        add(condition)
+    return cf
+
+
+class MemorySettings(object):
+    """
+    settings kept in memory with the QSettings methods used by UaClient,
+    for clients without GUI
+    """
+
+    def __init__(self, values=None):
+        self._values = dict(values or {})
+
+    def value(self, key, default=None):
+        return self._values.get(key, default)
+
+    def setValue(self, key, value):
+        self._values[key] = value
+
+
+class _ModelChangeHandler(object):
+    """
+    invalidate browse cache and type cache of server on GeneralModelChangeEvent.
+    Types already loaded stay in use until they are reloaded
+    """
+
+    def __init__(self, uaclient):
+        self.uaclient = uaclient
+
+    def event_notification(self, event):
+        self.uaclient.browse_cache.event_notification(event)
+        if types_changed(event):
+            logger.info("Data types of %s may have changed, invalidating type cache", self.uaclient._uri)
+            self.uaclient.type_cache.invalidate(self.uaclient._uri)
+
+
+class _SyncHandler(object):
+    """
+    pass notifications of an async subscription on to a handler
+    written for the sync API, nodes are given as SyncNode.
+    custom structures not known yet are loaded and decoded before
+    handler is called
+    """
+
+    def __init__(self, uaclient, handler):
+        self.uaclient = uaclient
+        self.tloop = uaclient.tloop
+        self.handler = handler
+
+    async def datachange_notification(self, node, val, data):
+        val = await self.uaclient.decode_value_async(val)
+        if self.uaclient.recorder is not None:
+            self.uaclient.recorder.datachange_notification(node, val, data)
+        self.handler.datachange_notification(SyncNode(self.tloop, node), val, data)
+
+    def event_notification(self, event):
+        if self.uaclient.recorder is not None:
+            self.uaclient.recorder.event_notification(event)
+        self.handler.event_notification(event)
+
+    def status_change_notification(self, status):
+        if hasattr(self.handler, "status_change_notification"):
+            self.handler.status_change_notification(status)
+
+
 class UaClient(object):
     """
     OPC-Ua client specialized for the need of GUI client
     return exactly what GUI needs, no customization possible
     """
 
-    def __init__(self):
-        self.settings = QSettings()
+    def __init__(self, settings=None):
+        if settings is None:
+            # imported here so clients without GUI do not load Qt
+            from PyQt5.QtCore import QSettings
+            settings = QSettings()
+        self.settings = settings
         self.application_uri = "urn:freeopcua:client-gui"
         self.client = None
+        self._tloop = None
+        self._uri = None
         self._connected = False
-        self._datachange_sub = None
+        self._missing_types = set()
+        self._operation_limits = {}
+        self.type_cache = TypeCache()
+        self._datachange_subs = {}  # (handler, publishing interval) -> subscription
         self._event_sub = None
-        self._subs_dc = {}
+        self._model_change_sub = None
+        self._subscription_lock = asyncio.Lock()
+        self._client_handle = 0
+        self._subs_dc = {}  # (handler, NodeId) -> (subscription, handle)
+        self._datachange_items = {}  # subscription -> number of monitored items
         self._subs_ev = {}
+        self.recorder = None  # uaclient.recorder.Recorder receiving all notifications when recording
         self.security_mode = None
         self.security_policy = None
         self.user_certificate_path = None
@@ -33,17 +274,67 @@ class UaClient(object):
         self.application_certificate_path = None
         self.application_private_key_path = None
         self.load_application_certificate_settings()
+        self.browse_cache = BrowseCache(int(self.settings.value("browse_cache_size", 20000)),
+                                        float(self.settings.value("browse_cache_ttl", 600)))
+        self.prefetch_children = self.settings.value("prefetch_children", "true") == "true"
+        self.max_references_per_node = 0  # 0 lets server decide
+        self.load_subscription_settings()
 
     def _reset(self):
         self.client = None
         self._connected = False
-        self._datachange_sub = None
+        self._missing_types = set()
+        self._operation_limits = {}
+        self._datachange_subs = {}
         self._event_sub = None
+        self._model_change_sub = None
         self._subs_dc = {}
+        self._datachange_items = {}
         self._subs_ev = {}
 
+    @property
+    def tloop(self):
+        """
+        asyncio loop running in its own thread, shared by all connections.
+        All requests to the server are sent from this loop
+        """
+        if self._tloop is None:
+            self._tloop = ThreadLoop()
+            self._tloop.daemon = True
+            self._tloop.start()
+        return self._tloop
+
+    @property
+    def aio_client(self):
+        """
+        the asyncua.Client behind the sync client
+        """
+        return self.client.aio_obj
+
+    def submit(self, coro):
+        """
+        schedule a coroutine on the client loop and return at once
+        a concurrent.futures.Future. Any number of requests may be
+        in flight at the same time on the secure channel
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.tloop.loop)
+
+    def run(self, coro):
+        """
+        run a coroutine on the client loop and block until it returns
+        """
+        return self.tloop.post(coro)
+
+    def sync_node(self, node):
+        """
+        wrap an async Node so it can be used by the widgets
+        """
+        return SyncNode(self.tloop, node)
+
     @staticmethod
     def get_endpoints(uri):
+        # asyncua.tools imports IPython, only load it when needed
+        from asyncua.tools import endpoint_to_strings
         client = Client(uri, timeout=2)
         edps = client.connect_and_get_server_endpoints()
         for i, ep in enumerate(edps, start=1):
@@ -79,6 +370,24 @@ class UaClient(object):
                            self.user_private_key_path]
         self.settings.setValue("security_settings", mysettings)
 
+    def load_subscription_settings(self):
+        mysettings = self.settings.value("subscription_settings", None)
+        self.subscription_parameters = SubscriptionParameters()
+        self.event_publishing_interval = 500
+        self.event_filter_parameters = EventFilterParameters()
+        if mysettings is None:
+            return
+        if "event_filter" in mysettings:
+            self.event_filter_parameters = EventFilterParameters.from_list(mysettings["event_filter"])
+        self.subscription_parameters = SubscriptionParameters.from_list(mysettings["parameters"])
+        self.event_publishing_interval = float(mysettings["event_publishing_interval"])
+
+    def save_subscription_settings(self):
+        mysettings = {"parameters": self.subscription_parameters.to_list(),
+                      "event_publishing_interval": self.event_publishing_interval,
+                      "event_filter": self.event_filter_parameters.to_list()}
+        self.settings.setValue("subscription_settings", mysettings)
+
     def load_application_certificate_settings(self):
         self.application_certificate_path = None
         self.application_private_key_path = None
@@ -102,73 +411,518 @@ class UaClient(object):
 
     def connect(self, uri):
         self.disconnect()
+        self.run(self.connect_async(uri))
+        self.run(self.load_types_async())
+        self.save_security_settings(uri)
+
+    async def connect_async(self, uri, progress=None):
+        """
+        open secure channel and activate session.
+        Custom types are not loaded, call load_types_async once
+        the client is usable.
+        progress is called with (text, stage, stage_count) from the client loop
+        """
+        _report(progress, 0)
         logger.info("Connecting to %s with parameters %s, %s, %s, %s", uri, self.security_mode, self.security_policy, self.user_certificate_path, self.user_private_key_path)
-        self.client = Client(uri)
+        self._uri = uri
+        self.client = Client(uri, tloop=self.tloop)
         self.client.application_uri = self.application_uri
-        self.client.description = "FreeOpcUa Client GUI"
+        self.aio_client.description = "FreeOpcUa Client GUI"
 
         # Set user identity token
         if self.user_private_key_path:
-            self.client.load_private_key(self.user_private_key_path)
+            await self.aio_client.load_private_key(self.user_private_key_path)
         if self.user_certificate_path:
-            self.client.load_client_certificate(self.user_certificate_path)
+            await self.aio_client.load_client_certificate(self.user_certificate_path)
 
         # Set security mode and security policy
         if self.security_mode is not None and self.security_policy is not None:
-            self.client.set_security(
+            await self.aio_client.set_security(
                 getattr(crypto.security_policies, 'SecurityPolicy' + self.security_policy),
                 self.application_certificate_path,
                 self.application_private_key_path,
                 mode=getattr(ua.MessageSecurityMode, self.security_mode)
             )
-        self.client.connect()
+        if timer.enabled:
+            for name, phase in CONNECT_STEPS:
+                setattr(self.aio_client, name, timer.timed(phase, getattr(self.aio_client, name)))
+        try:
+            await self.aio_client.connect()
+        finally:
+            if timer.enabled:
+                # only the first connect is timed, not renewing the secure channel later
+                for name, phase in CONNECT_STEPS:
+                    delattr(self.aio_client, name)
         self._connected = True
-        self.client.load_data_type_definitions()
+        with timer.phase("Subscribe to model changes"):
+            await self._watch_model_changes()
+
+    async def _watch_model_changes(self):
+        try:
+            self._model_change_sub = await self.aio_client.create_subscription(1000, _ModelChangeHandler(self))
+            await self._model_change_sub.subscribe_events(ua.ObjectIds.Server, ua.ObjectIds.GeneralModelChangeEventType)
+        except Exception as ex:
+            # cache entries still expire after browse_cache.ttl
+            logger.warning("Could not subscribe to model change events, caches are not invalidated by server: %s", ex)
+
+    async def reload_types_async(self, progress=None):
+        """
+        read type definitions from server again, ignoring type cache,
+        and replace the classes generated before
+        """
+        self.type_cache.invalidate(self._uri)
+        self._missing_types = set()
+        await self.load_types_async(progress, overwrite=True)
+
+    async def load_types_async(self, progress=None, overwrite=False):
+        """
+        generate classes for custom structures and enums of server.
+        Definitions are taken from type cache if server model did not change.
+        Values of custom types arriving before this is done are decoded
+        on demand, see decode_value_async
+        """
+        _report(progress, 1)
+        with timer.phase("Read type fingerprint"):
+            fingerprint = await self.type_cache.fingerprint(self.aio_client, self._uri)
+        with timer.phase("Load type cache"):
+            definitions = self.type_cache.load(self._uri, fingerprint)
+        from_cache = definitions is not None
+        if not from_cache:
+            definitions = TypeDefinitions()
+            with timer.phase("Read data type definitions"):
+                await definitions.read(self.aio_client)
+            try:
+                self.type_cache.save(self._uri, fingerprint, definitions)
+            except OSError:
+                logger.exception("Could not save type cache of %s", self._uri)
+        else:
+            logger.info("Loading data type definitions of %s from cache", self._uri)
+        with timer.phase("Register types"):
+            definitions.register(overwrite)
+        # type dictionaries of spec <= 1.03 are not cached, only read them
+        # again if server does not provide DataTypeDefinition
+        if not from_cache or not definitions.structs:
+            try:
+                _report(progress, 2)
+                with timer.phase("Load enums"):
+                    await self.aio_client.load_enums()
+                _report(progress, 3)
+                with timer.phase("Load type dictionaries"):
+                    await self.aio_client.load_type_definitions()
+            except Exception:
+                logger.exception("Loading custom stuff with spec <= 1.03 did not work")
+        _report(progress, 4)
+
+    async def decode_value_async(self, val):
+        """
+        decode ExtensionObjects of types not loaded yet,
+        the type definition is read from server the first time it is seen
+        """
+        if isinstance(val, list):
+            return [await self.decode_value_async(v) for v in val]
+        if type(val) is not ua.ExtensionObject or val.Body is None:
+            return val
+        cls = ua.extension_objects_by_typeid.get(val.TypeId)
+        if cls is None:
+            cls = await self._load_type_for_encoding(val.TypeId)
+            if cls is None:
+                return val
+        return ua.ua_binary.from_binary(cls, Buffer(val.Body))
+
+    async def _load_type_for_encoding(self, encoding_id):
+        if encoding_id in self._missing_types:
+            return None
+        encoding_node = self.aio_client.get_node(encoding_id)
+        refs = await encoding_node.get_references(refs=ua.ObjectIds.HasEncoding, direction=ua.BrowseDirection.Inverse)
+        if not refs:
+            logger.warning("Could not find data type of encoding %s", encoding_id)
+            self._missing_types.add(encoding_id)
+            return None
+        logger.info("Loading on demand data type %s", refs[0].NodeId)
         try:
-            self.client.load_enums()
-            self.client.load_type_definitions()
+            return await load_custom_struct(self.aio_client.get_node(refs[0].NodeId))
         except Exception:
-            logger.exception("Loading custom stuff with spec <= 1.03 did not work")
-        self.save_security_settings(uri)
+            logger.exception("Could not load data type %s", refs[0].NodeId)
+            self._missing_types.add(encoding_id)
+            return None
 
     def disconnect(self):
         if self._connected:
-            print("Disconnecting from server")
+            logger.info("Disconnecting from server")
             self._connected = False
             try:
                 self.client.disconnect()
             finally:
                 self._reset()
+                # servers without model change events would otherwise show stale children
+                self.run(self.invalidate_browse_cache_async(None))
 
-    def subscribe_datachange(self, node, handler):
-        if not self._datachange_sub:
-            self._datachange_sub = self.client.create_subscription(500, handler)
-        handle = self._datachange_sub.subscribe_data_change(node)
-        self._subs_dc[node.nodeid] = handle
+    def subscribe_datachange(self, node, handler, params=None):
+        return self.run(self.subscribe_datachange_async(node, handler, params))
+
+    async def subscribe_datachange_async(self, node, handler, params=None):
+        """
+        monitor value of node with params, or default subscription_parameters.
+        Node is added to the subscription of its rate class
+        """
+        handle = (await self.subscribe_datachange_many_async([node], handler, params))[0]
+        if isinstance(handle, ua.StatusCode):
+            handle.check()
         return handle
 
-    def unsubscribe_datachange(self, node):
-        self._datachange_sub.unsubscribe(self._subs_dc[node.nodeid])
+    async def subscribe_datachange_many_async(self, nodes, handler, params=None):
+        """
+        monitor value of many nodes, monitored items are created in
+        requests of up to MaxMonitoredItemsPerCall items.
+        return a list with a handle or a bad StatusCode per node
+        """
+        if params is None:
+            params = self.subscription_parameters
+        nodeids = [node if isinstance(node, ua.NodeId) else node.nodeid for node in nodes]
+        limit = await self.operation_limit("MaxMonitoredItemsPerCall") or len(nodeids) or 1
+        chunks = [nodeids[start:start + limit] for start in range(0, len(nodeids), limit)]
+        # an unsubscribe must not delete the subscription while items are added to it
+        async with self._subscription_lock:
+            sub = await self._get_datachange_subscription(handler, params.publishing_interval)
+            results = await asyncio.gather(*[
+                sub.create_monitored_items([self._monitored_item_request(nodeid, params) for nodeid in chunk])
+                for chunk in chunks])
+            handles = [handle for result in results for handle in result]
+            for nodeid, handle in zip(nodeids, handles):
+                if not isinstance(handle, ua.StatusCode):
+                    self._subs_dc[(handler, nodeid)] = (sub, handle)
+                    self._datachange_items[sub] += 1
+            await self._delete_empty_subscription(sub)
+        return handles
+
+    async def _get_datachange_subscription(self, handler, publishing_interval):
+        # notifications of a subscription all go to the same handler, call with _subscription_lock held
+        sub = self._datachange_subs.get((handler, publishing_interval))
+        if sub is None:
+            logger.info("Creating subscription with publishing interval %s ms", publishing_interval)
+            sub = await self.aio_client.create_subscription(publishing_interval, _SyncHandler(self, handler))
+            self._datachange_subs[(handler, publishing_interval)] = sub
+            self._datachange_items[sub] = 0
+        return sub
+
+    async def _delete_empty_subscription(self, sub):
+        # otherwise server keeps publishing keep alives of a subscription without items
+        if self._datachange_items[sub]:
+            return
+        del self._datachange_items[sub]
+        for key, value in list(self._datachange_subs.items()):
+            if value is sub:
+                del self._datachange_subs[key]
+                logger.info("Deleting subscription with publishing interval %s ms", key[1])
+        await sub.delete()
+
+    def _monitored_item_request(self, nodeid, params):
+        self._client_handle += 1
+        mparams = ua.MonitoringParameters()
+        mparams.ClientHandle = self._client_handle
+        mparams.SamplingInterval = params.sampling_interval
+        mparams.QueueSize = params.queue_size
+        mparams.DiscardOldest = params.discard_oldest
+        mfilter = params.make_filter()
+        if mfilter is not None:
+            mparams.Filter = mfilter
+        rv = ua.ReadValueId()
+        rv.NodeId = nodeid
+        rv.AttributeId = ua.AttributeIds.Value
+        mir = ua.MonitoredItemCreateRequest()
+        mir.ItemToMonitor = rv
+        mir.MonitoringMode = ua.MonitoringMode.Reporting
+        mir.RequestedParameters = mparams
+        return mir
+
+    def unsubscribe_datachange(self, node, handler):
+        self.run(self.unsubscribe_datachange_async(node, handler))
+
+    async def unsubscribe_datachange_async(self, node, handler):
+        async with self._subscription_lock:
+            sub, handle = self._subs_dc.pop((handler, node.nodeid))
+            try:
+                await sub.unsubscribe(handle)
+            finally:
+                self._datachange_items[sub] -= 1
+                await self._delete_empty_subscription(sub)
 
-    def subscribe_events(self, node, handler):
-        if not self._event_sub:
-            print("subscirbing with handler: ", handler, dir(handler))
-            self._event_sub = self.client.create_subscription(500, handler)
-        handle = self._event_sub.subscribe_events(node)
+    async def collect_variables_async(self, nodes, max_count=None):
+        """
+        return reference descriptions of Variables below nodes, Objects
+        are followed level by level with batched browsing. Properties are skipped
+        """
+        found = []
+        seen = set()
+        level = [node if isinstance(node, ua.NodeId) else _aio_node(node).nodeid for node in nodes]
+        mask = ua.NodeClass.Object | ua.NodeClass.Variable
+        while level:
+            next_level = []
+            browse = self.iter_browse_async(level, nodeclassmask=mask)
+            try:
+                async for _, descs in browse:
+                    for desc in descs:
+                        if desc.NodeId in seen:
+                            continue
+                        seen.add(desc.NodeId)
+                        if desc.NodeClass == ua.NodeClass.Object:
+                            next_level.append(desc.NodeId)
+                        elif desc.ReferenceTypeId != ua.NodeId(ua.ObjectIds.HasProperty):
+                            found.append(desc)
+                            if max_count and len(found) >= max_count:
+                                return found
+            finally:
+                # releases continuation points of nodes not browsed to the end
+                await browse.aclose()
+            level = next_level
+        return found
+
+    def subscribe_events(self, node, handler, filter_params=None):
+        return self.run(self.subscribe_events_async(node, handler, filter_params))
+
+    async def subscribe_events_async(self, node, handler, filter_params=None):
+        """
+        subscribe to events of node, filtered on server with filter_params
+        or default event_filter_parameters
+        """
+        if filter_params is None:
+            filter_params = self.event_filter_parameters
+        async with self._subscription_lock:
+            if not self._event_sub:
+                self._event_sub = await self.aio_client.create_subscription(self.event_publishing_interval, _SyncHandler(self, handler))
+        evfilter = await filter_params.make_filter(self.aio_client)
+        handle = await self._event_sub.subscribe_events(_aio_node(node), evfilter=evfilter)
         self._subs_ev[node.nodeid] = handle
         return handle
 
     def unsubscribe_events(self, node):
-        self._event_sub.unsubscribe(self._subs_ev[node.nodeid])
+        self.run(self.unsubscribe_events_async(node))
+
+    async def unsubscribe_events_async(self, node):
+        await self._event_sub.unsubscribe(self._subs_ev.pop(node.nodeid))
 
     def get_node_attrs(self, node):
-        if not isinstance(node, SyncNode):
-            node = self.client.get_node(node)
-        attrs = node.read_attributes([ua.AttributeIds.DisplayName, ua.AttributeIds.BrowseName, ua.AttributeIds.NodeId])
-        return node, [attr.Value.Value.to_string() for attr in attrs]
+        return self.run(self.get_node_attrs_async(node))
 
-    @staticmethod
-    def get_children(node):
-        descs = node.get_children_descriptions()
+    async def get_node_attrs_async(self, node):
+        if isinstance(node, SyncNode):
+            node = node.aio_obj
+        else:
+            node = self.aio_client.get_node(node)
+        attrs = [ua.AttributeIds.DisplayName, ua.AttributeIds.BrowseName, ua.AttributeIds.NodeId]
+        columns = await self.read_attributes_async([node.nodeid], attrs)
+        return self.sync_node(node), [columns[attr][0].Value.Value.to_string() for attr in attrs]
+
+    def read_attributes(self, nodes, attrs):
+        return self.run(self.read_attributes_async(nodes, attrs))
+
+    async def read_attributes_async(self, nodes, attrs):
+        """
+        read attributes attrs of all nodes with as few requests as possible.
+        Requests of up to MaxNodesPerRead values are sent at the same time.
+        return columns: a dict attribute id -> list of DataValue in order of nodes
+        """
+        nodeids = [node if isinstance(node, ua.NodeId) else _aio_node(node).nodeid for node in nodes]
+        to_read = []
+        for nodeid in nodeids:
+            for attr in attrs:
+                rv = ua.ReadValueId()
+                rv.NodeId = nodeid
+                rv.AttributeId = attr
+                to_read.append(rv)
+        limit = await self.operation_limit("MaxNodesPerRead") or len(to_read) or 1
+        requests = []
+        for start in range(0, len(to_read), limit):
+            params = ua.ReadParameters()
+            params.NodesToRead = to_read[start:start + limit]
+            requests.append(self.aio_client.uaclient.read(params))
+        values = []
+        for result in await asyncio.gather(*requests):
+            values.extend(result)
+        count = len(attrs)
+        return {attr: values[i::count] for i, attr in enumerate(attrs)}
+
+    async def iter_history_async(self, node, start, end, values_per_request=0):
+        """
+        read raw history of node between start and end, following continuation points.
+        yield the list of DataValue of each response as soon as it arrives,
+        values are in reverse order if start is after end
+        """
+        details = ua.ReadRawModifiedDetails()
+        details.IsReadModified = False
+        details.StartTime = start
+        details.EndTime = end
+        details.NumValuesPerNode = values_per_request
+        details.ReturnBounds = False
+        node = _aio_node(node)
+        point = None
+        try:
+            while True:
+                result = await node.history_read(details, point)
+                result.StatusCode.check()
+                point = result.ContinuationPoint
+                yield result.HistoryData.DataValues if result.HistoryData else []
+                if not point:
+                    break
+        finally:
+            if point:
+                # consumer stopped before the end, let server free its resources
+                await self._release_history_point(node.nodeid, details, point)
+
+    async def _release_history_point(self, nodeid, details, point):
+        valueid = ua.HistoryReadValueId()
+        valueid.NodeId = nodeid
+        valueid.ContinuationPoint = point
+        params = ua.HistoryReadParameters()
+        params.HistoryReadDetails = details
+        params.ReleaseContinuationPoints = True
+        params.NodesToRead = [valueid]
+        try:
+            await self.aio_client.uaclient.history_read(params)
+        except Exception as ex:
+            logger.warning("Could not release history continuation point of %s: %s", nodeid, ex)
+
+    async def operation_limit(self, name):
+        """
+        return an OperationLimits value of server, like MaxNodesPerBrowse.
+        0 means no limit or not reported by server
+        """
+        if name not in self._operation_limits:
+            node = self.aio_client.get_node(getattr(ua.ObjectIds, "Server_ServerCapabilities_OperationLimits_" + name))
+            try:
+                self._operation_limits[name] = int(await node.read_value() or 0)
+            except ua.UaError:
+                self._operation_limits[name] = 0
+        return self._operation_limits[name]
+
+    def get_children(self, node, refs=ua.ObjectIds.HierarchicalReferences, nodeclassmask=ua.NodeClass.Unspecified):
+        return self.run(self.get_children_async(node, refs, nodeclassmask))
+
+    async def get_children_async(self, node, refs=ua.ObjectIds.HierarchicalReferences, nodeclassmask=ua.NodeClass.Unspecified):
+        """
+        return sorted reference descriptions of children of node,
+        results are taken from browse cache when possible.
+        Raise UaStatusCodeError if node cannot be browsed
+        """
+        nodeid = _aio_node(node).nodeid
+        results = await self.browse_many_async([nodeid], refs, nodeclassmask, check=True)
+        return results[nodeid]
+
+    async def invalidate_browse_cache_async(self, nodeids):
+        """
+        forget cached browse results of nodeids, or all if nodeids is None.
+        Browse cache is only used from client loop
+        """
+        if nodeids is None:
+            self.browse_cache.clear()
+            return
+        for nodeid in nodeids:
+            self.browse_cache.invalidate(nodeid)
+
+    async def browse_many_async(self, nodes, refs=ua.ObjectIds.HierarchicalReferences, nodeclassmask=ua.NodeClass.Unspecified,
+                                check=False):
+        """
+        browse children of many nodes at once, return a dict NodeId -> sorted reference descriptions.
+        See iter_browse_async for check
+        """
+        results = {}
+        async for nodeid, descs in self.iter_browse_async(nodes, refs, nodeclassmask, check):
+            results[nodeid] = descs
+        return results
+
+    async def iter_browse_async(self, nodes, refs=ua.ObjectIds.HierarchicalReferences, nodeclassmask=ua.NodeClass.Unspecified,
+                                check=False):
+        """
+        browse children of many nodes with as few requests as possible.
+        Nodes are sent in Browse requests of up to MaxNodesPerBrowse nodes and
+        continuation points of all nodes are followed together with BrowseNext.
+        yield (NodeId, sorted reference descriptions) as soon as a node is complete.
+        A node which cannot be browsed raises UaStatusCodeError if check is set,
+        otherwise it is logged and yields the references received so far
+        """
+        todo = []
+        for node in nodes:
+            nodeid = node if isinstance(node, ua.NodeId) else _aio_node(node).nodeid
+            descs = self.browse_cache.get((nodeid, refs, nodeclassmask))
+            if descs is None:
+                todo.append(nodeid)
+            else:
+                yield nodeid, list(descs)
+        if not todo:
+            return
+        limit = await self.operation_limit("MaxNodesPerBrowse") or len(todo)
+        pending = {}  # continuation point -> (nodeid, descriptions so far)
+        try:
+            for start in range(0, len(todo), limit):
+                chunk = todo[start:start + limit]
+                params = ua.BrowseParameters()
+                params.View = ua.ViewDescription()
+                params.RequestedMaxReferencesPerNode = self.max_references_per_node
+                params.NodesToBrowse = [_browse_description(nodeid, refs, nodeclassmask) for nodeid in chunk]
+                results = await self.aio_client.uaclient.browse(params)
+                # all results are handled before yielding, so pending holds every
+                # continuation point if consumer stops early
+                done = [(nodeid, self._browse_result(nodeid, result, [], pending, refs, nodeclassmask, check))
+                        for nodeid, result in zip(chunk, results)]
+                for nodeid, descs in done:
+                    if descs is not None:
+                        yield nodeid, descs
+                while pending:
+                    params = ua.BrowseNextParameters()
+                    params.ReleaseContinuationPoints = False
+                    params.ContinuationPoints = list(pending)
+                    results = await self.aio_client.uaclient.browse_next(params)
+                    previous, pending = pending, {}
+                    done = []
+                    for point, result in zip(params.ContinuationPoints, results):
+                        nodeid, descs = previous[point]
+                        done.append((nodeid, self._browse_result(nodeid, result, descs, pending, refs, nodeclassmask, check)))
+                    for nodeid, descs in done:
+                        if descs is not None:
+                            yield nodeid, descs
+        finally:
+            if pending:
+                # consumer stopped before the end, let server free continuation points,
+                # servers only allow a few per session
+                await self._release_browse_points(list(pending))
+
+    async def _release_browse_points(self, points):
+        params = ua.BrowseNextParameters()
+        params.ReleaseContinuationPoints = True
+        params.ContinuationPoints = points
+        try:
+            await self.aio_client.uaclient.browse_next(params)
+        except Exception as ex:
+            logger.warning("Could not release %s browse continuation points: %s", len(points), ex)
+
+    def _browse_result(self, nodeid, result, descs, pending, refs, nodeclassmask, check):
+        if check:
+            result.StatusCode.check()
+        if not result.StatusCode.is_good():
+            # only this node fails, references of earlier responses are kept but not cached
+            logger.warning("Browsing %s failed: %s", nodeid, result.StatusCode)
+            return sorted(descs, key=lambda x: x.BrowseName)
+        descs.extend(result.References)
+        if result.ContinuationPoint:
+            pending[result.ContinuationPoint] = (nodeid, descs)
+            return None
         descs.sort(key=lambda x: x.BrowseName)
-        return descs
+        self.browse_cache.put((nodeid, refs, nodeclassmask), descs)
+        return list(descs)
+
+
+def _browse_description(nodeid, refs, nodeclassmask):
+    desc = ua.BrowseDescription()
+    desc.NodeId = nodeid
+    desc.BrowseDirection = ua.BrowseDirection.Forward
+    desc.ReferenceTypeId = ua.NodeId(refs)
+    desc.IncludeSubtypes = True
+    desc.NodeClassMask = nodeclassmask
+    desc.ResultMask = ua.BrowseResultMask.All
+    return desc
+
+
+def _aio_node(node):
+    if isinstance(node, SyncNode):
+        return node.aio_obj
+    return node